@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+###############################################################
+# alertengine.py module evaluates alert rules on the stream   #
+# of measurement samples, without querying the database:      #
+#     - threshold - value above/below limit, with hysteresis  #
+#     - rate      - change of value per minute over time      #
+#                   window above limit, with hysteresis       #
+#     - stale     - no sample of the sensor for timeout sec   #
+# Rules are compiled once into per-series (sensor id, field)  #
+# dispatch tables, so every sample is checked only against    #
+# rules of its own series, each in O(1). Rule fires at most   #
+# once per cooldown and emits "firing" and "resolved" events. #
+# Rules are loaded from json file, i.e.:                      #
+#     {"rules": [{"name": "indoor_hot", "type": "threshold",  #
+#                 "sensor_id": "564ac640bedb",                #
+#                 "field": "temperature_C", "above": 28,      #
+#                 "hysteresis": 0.5, "cooldown": 600}]}       #
+# sensor_id "*" applies the rule to every sensor.             #
+###############################################################
+
+import time
+import json
+import logging
+import threading
+import sys
+from collections import deque
+
+#Supported rule types and their required parameters
+RULE_TYPES = {
+    "threshold": ("field",),
+    "rate": ("field", "max_rate", "window"),
+    "stale": ("timeout",),
+}
+#Default minimal interval between two "firing" events of the same rule in sec
+DEFAULT_COOLDOWN = 300
+WILDCARD = "*"
+
+
+class AlertRule:
+    #Common state of the rule instance for single series: active flag,
+    #cooldown and building of the events
+
+    def __init__(self, spec, sensor_id, field):
+        self.spec = spec
+        self.name = spec["name"]
+        self.sensor_id = sensor_id
+        self.field = field
+        self.hysteresis = float(spec.get("hysteresis", 0.0))
+        self.cooldown = float(spec.get("cooldown", DEFAULT_COOLDOWN))
+        self.severity = spec.get("severity", "warning")
+        self.active = False
+        self.last_fired = None
+
+    def transition(self, firing, value, limit, timestamp_ns, now):
+        #returns event when state of the rule changes, None otherwise
+        if firing == self.active:
+            return None
+        if firing:
+            if self.last_fired is not None and now - self.last_fired < self.cooldown:
+                #condition is evaluated again with the next sample
+                return None
+            self.last_fired = now
+        self.active = firing
+        return {
+            "rule": self.name,
+            "type": self.spec["type"],
+            "state": "firing" if firing else "resolved",
+            "severity": self.severity,
+            "sensor_id": self.sensor_id,
+            "field": self.field,
+            "value": value,
+            "limit": limit,
+            "timestamp_ns": timestamp_ns,
+        }
+
+
+class ThresholdRule(AlertRule):
+
+    def __init__(self, spec, sensor_id, field):
+        AlertRule.__init__(self, spec, sensor_id, field)
+        self.above = spec.get("above")
+        self.below = spec.get("below")
+
+    def evaluate(self, value, timestamp_ns, now):
+        #active rule is resolved only after value gets back beyond the
+        #limit by hysteresis, so noisy value around the limit does not flap
+        margin = self.hysteresis if self.active else 0.0
+        if self.above is not None and value > self.above - margin:
+            return self.transition(True, value, self.above, timestamp_ns, now)
+        if self.below is not None and value < self.below + margin:
+            return self.transition(True, value, self.below, timestamp_ns, now)
+        return self.transition(False, value, self.above if self.above is not None else self.below, timestamp_ns, now)
+
+
+class RateRule(AlertRule):
+    #Rate is computed between the current sample and the oldest sample of
+    #the window, samples are kept in deque, so every sample costs amortized O(1)
+
+    def __init__(self, spec, sensor_id, field):
+        AlertRule.__init__(self, spec, sensor_id, field)
+        self.max_rate = float(spec["max_rate"])
+        self.window_ns = int(float(spec["window"]) * 1000000000)
+        self.samples = deque()
+
+    def evaluate(self, value, timestamp_ns, now):
+        samples = self.samples
+        samples.append((timestamp_ns, value))
+        while timestamp_ns - samples[0][0] > self.window_ns:
+            samples.popleft()
+        oldest_ns, oldest_value = samples[0]
+        #rate is evaluated only when at least half of the window is covered
+        if timestamp_ns - oldest_ns < self.window_ns / 2:
+            return None
+        rate = (value - oldest_value) * 60000000000 / (timestamp_ns - oldest_ns)
+        if self.active:
+            firing = abs(rate) > self.max_rate - self.hysteresis
+        else:
+            firing = abs(rate) > self.max_rate
+        return self.transition(firing, round(rate, 3), self.max_rate, timestamp_ns, now)
+
+
+class StaleRule(AlertRule):
+
+    def __init__(self, spec, sensor_id, field, now):
+        AlertRule.__init__(self, spec, sensor_id, field)
+        self.timeout = float(spec["timeout"])
+        self.last_seen = now
+        self.last_timestamp_ns = None
+
+    def evaluate(self, value, timestamp_ns, now):
+        self.last_seen = now
+        self.last_timestamp_ns = timestamp_ns
+        return self.transition(False, value, self.timeout, timestamp_ns, now)
+
+    def check(self, now):
+        if self.active or now - self.last_seen < self.timeout:
+            return None
+        return self.transition(True, round(now - self.last_seen, 1), self.timeout, self.last_timestamp_ns, now)
+
+
+def LoadAlertRules(rules_file):
+    #returns list of validated rule specs, raises OSError or ValueError
+    with open(rules_file) as f:
+        config = json.load(f)
+    rules = config.get("rules", []) if isinstance(config, dict) else config
+    names = set()
+    for spec in rules:
+        name = spec.get("name")
+        if not name or name in names:
+            raise ValueError("rule name missing or not unique: %r" % name)
+        names.add(name)
+        rule_type = spec.get("type")
+        if rule_type not in RULE_TYPES:
+            raise ValueError("rule %s: unsupported type %r" % (name, rule_type))
+        for param in RULE_TYPES[rule_type]:
+            if param not in spec:
+                raise ValueError("rule %s: missing parameter %s" % (name, param))
+        if rule_type == "threshold" and spec.get("above") is None and spec.get("below") is None:
+            raise ValueError("rule %s: above or below limit is required" % name)
+        if "sensor_id" not in spec:
+            raise ValueError("rule %s: missing parameter sensor_id" % name)
+    return rules
+
+
+class AlertEngine:
+    #Evaluates compiled rules on samples, events are passed to on_event
+    #callback. Samples and stale checks may come from different threads.
+
+    def __init__(self, rules, on_event=None):
+        self.on_event = on_event
+        self.lock = threading.Lock()
+        now = time.monotonic()
+        #rule specs by (sensor id, field) and by field for wildcard sensor id,
+        #field is optional for stale rules
+        self.series_specs = {}
+        self.wildcard_specs = {}
+        self.wildcard_stale_specs = []
+        #compiled rule instances of every series seen so far
+        self.dispatch = {}
+        self.stale_rules = []
+        #sensors already checked against wildcard stale rules
+        self.stale_sensors = set()
+        for spec in rules:
+            sensor_id = str(spec["sensor_id"])
+            if spec["type"] == "stale":
+                if sensor_id == WILDCARD:
+                    self.wildcard_stale_specs.append(spec)
+                else:
+                    #stale rule of explicitly configured sensor runs from the
+                    #start, so the sensor which never reports is reported too
+                    self.stale_rules.append(StaleRule(spec, sensor_id, spec.get("field"), now))
+            elif sensor_id == WILDCARD:
+                self.wildcard_specs.setdefault(spec["field"], []).append(spec)
+            else:
+                self.series_specs.setdefault((sensor_id, spec["field"]), []).append(spec)
+        logging.info('Alerts: %i rules compiled', len(rules))
+
+    def compile_series(self, sensor_id, field):
+        #builds dispatch table entry at the first sample of the series
+        now = time.monotonic()
+        rules = []
+        for spec in self.series_specs.get((sensor_id, field), []) + self.wildcard_specs.get(field, []):
+            if spec["type"] == "threshold":
+                rules.append(ThresholdRule(spec, sensor_id, field))
+            else:
+                rules.append(RateRule(spec, sensor_id, field))
+        if sensor_id not in self.stale_sensors:
+            self.stale_sensors.add(sensor_id)
+            for spec in self.wildcard_stale_specs:
+                self.stale_rules.append(StaleRule(spec, sensor_id, spec.get("field"), now))
+        for rule in self.stale_rules:
+            if rule.sensor_id == sensor_id and rule.field in (None, field):
+                rules.append(rule)
+        self.dispatch[(sensor_id, field)] = rules
+        return rules
+
+    def process(self, sensor_id, field, value, timestamp_ns, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            rules = self.dispatch.get((sensor_id, field))
+            if rules is None:
+                rules = self.compile_series(sensor_id, field)
+            for rule in rules:
+                event = rule.evaluate(value, timestamp_ns, now)
+                if event is not None:
+                    self.emit(event)
+
+    def process_fields(self, sensor_id, timestamp_ns, fields, now=None):
+        for field, value in fields.items():
+            self.process(sensor_id, field, value, timestamp_ns, now)
+
+    def check_stale(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            for rule in self.stale_rules:
+                event = rule.check(now)
+                if event is not None:
+                    self.emit(event)
+
+    def emit(self, event):
+        logging.warning('Alert %s %s: sensor %s, %s=%s (limit %s)', event["rule"], event["state"], event["sensor_id"], event["field"], event["value"], event["limit"])
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:
+                logging.error('Alerts: failed to publish event of rule %s: %s', event["rule"], repr(sys.exc_info()[1]))
@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+
+###############################################################
+# bme280registry.py module manages all BME280 sensors of      #
+# digitalthermometer:                                         #
+#     - discovers BME280 chips at configured addresses (0x76  #
+#       and 0x77) on every configured i2c bus                 #
+#     - loads calibration data once per device (cached in     #
+#       json file, see LoadBME280Calibration)                 #
+#     - polls every bus in its own thread, so slow or failing #
+#       bus does not delay reading of the other buses         #
+#     - gives every device stable id derived from bus number  #
+#       and address, unless id is configured explicitly       #
+#     - counts cycles without new sample of every device and  #
+#       rounds not completed by every poller, so hung i2c     #
+#       read is detected by measurement loop                  #
+###############################################################
+
+import threading
+import time
+import logging
+import json
+import sys
+
+#BME280 chip id register and its value (BMP280 reports 0x58)
+BME280_CHIP_ID_REGISTER = 0xD0
+BME280_CHIP_ID = 0x60
+
+
+def BME280SensorId(bus_no, address, sensor_ids):
+    #explicitly configured id or id derived from bus and address, i.e. "bme280-1-77"
+    return sensor_ids.get((bus_no, address), "bme280-%i-%02x" % (bus_no, address))
+
+def ProbeBME280(bus, address):
+    try:
+        return bus.read_byte_data(address, BME280_CHIP_ID_REGISTER) == BME280_CHIP_ID
+    except OSError:
+        return False
+
+def LoadBME280Calibration(bus, address, calibration_file, recalibrate):
+    import bme280
+    #calibration data is read from the file if it is available, sensor
+    #is accessed only at first start or when recalibration is requested
+    if recalibrate == False:
+        try:
+            with open(calibration_file) as f:
+                calibration_params = bme280.params(json.load(f))
+            logging.info('BME280: Calibration data loaded from: %s', calibration_file)
+            return calibration_params
+        except (OSError, ValueError):
+            logging.info('BME280: Calibration data not available in: %s, reading it from the sensor...', calibration_file)
+    calibration_params = bme280.load_calibration_params(bus, address)
+    try:
+        with open(calibration_file, "w") as f:
+            json.dump(dict(calibration_params), f)
+        logging.info('BME280: Calibration data stored in: %s', calibration_file)
+    except OSError:
+        logging.warning('BME280: Failed to store calibration data: %s', sys.exc_info()[1])
+    return calibration_params
+
+
+class BME280Device:
+    #Single BME280 chip. Latest sample is stored by bus poller thread,
+    #record is measurement record entry updated in place when new sample
+    #is collected by measurement loop.
+
+    def __init__(self, bus_no, address, sensor_id, calibration_params, breaker):
+        self.bus_no = bus_no
+        self.address = address
+        self.sensor_id = sensor_id
+        self.calibration_params = calibration_params
+        self.breaker = breaker
+        self.data = None
+        self.timestamp_ns = 0
+        self.seq = 0
+        self.consumed_seq = 0
+        #measurement loop cycles since the last collected sample
+        self.missed_cycles = 0
+        self.temperature = {"value":0.0, "unit":"C"}
+        self.pressure = {"value":0.0, "unit":"hPa"}
+        self.humidity = {"value":0.0, "unit":"rH"}
+        self.record = {"id":sensor_id, "timestamp_ns":0, "temperature":self.temperature, "pressure":self.pressure, "humidity":self.humidity}
+
+    def update_record(self):
+        self.record["timestamp_ns"] = self.timestamp_ns
+        self.temperature["value"] = float(self.data.temperature)
+        self.pressure["value"] = float(self.data.pressure)
+        self.humidity["value"] = float(self.data.humidity)
+
+
+class BME280BusPoller(threading.Thread):
+    #Reads all devices of single i2c bus when registry requests new round
+
+    def __init__(self, registry, bus_no, bus, devices):
+        threading.Thread.__init__(self, name="BME280Bus" + str(bus_no), daemon=True)
+        self.registry = registry
+        self.bus_no = bus_no
+        self.bus = bus
+        self.devices = devices
+        self.request = threading.Event()
+        self.completed_round = 0
+
+    def run(self):
+        import bme280
+        samples = [None] * len(self.devices)
+        timestamps = [0] * len(self.devices)
+        while True:
+            self.request.wait()
+            self.request.clear()
+            round_no = self.registry.round
+            for i, device in enumerate(self.devices):
+                samples[i] = None
+                if not device.breaker.allow_read():
+                    continue
+                try:
+                    samples[i] = bme280.sample(self.bus, device.address, device.calibration_params)
+                    #sample time as integer epoch in ns, taken right after the read
+                    timestamps[i] = time.time_ns()
+                    device.breaker.record_success()
+                except OSError as e:
+                    if e.args and e.args[0] == 121:
+                        #Catch Error 121 - Remote I/O Error
+                        device.breaker.record_failure('sensor is not reachable')
+                    else:
+                        device.breaker.record_failure(repr(e))
+                except Exception as e:
+                    #any other error must not stop the poller thread
+                    device.breaker.record_failure(repr(e))
+            with self.registry.condition:
+                for i, device in enumerate(self.devices):
+                    if samples[i] is not None:
+                        device.data = samples[i]
+                        device.timestamp_ns = timestamps[i]
+                        device.seq = device.seq + 1
+                self.completed_round = round_no
+                self.registry.condition.notify_all()
+
+
+class BME280Registry:
+    #Discovered BME280 devices and their bus pollers. Measurement loop
+    #requests new samples at the beginning of the cycle and collects
+    #them later, so sensors are read in parallel with other work.
+
+    def __init__(self):
+        self.devices = []
+        self.pollers = []
+        self.condition = threading.Condition()
+        self.round = 0
+        self.new_devices = []
+
+    def discover(self, buses, addresses, sensor_ids, calibration_file_pattern, recalibrate, breaker_factory):
+        #buses is dict of bus number and opened bus, breaker_factory creates
+        #circuit breaker for device (name, index of the device)
+        for bus_no, bus in buses.items():
+            bus_devices = []
+            for address in addresses:
+                if not ProbeBME280(bus, address):
+                    continue
+                sensor_id = BME280SensorId(bus_no, address, sensor_ids)
+                calibration_file = calibration_file_pattern.format(bus=bus_no, address=hex(address))
+                try:
+                    calibration_params = LoadBME280Calibration(bus, address, calibration_file, recalibrate)
+                except OSError:
+                    logging.error('BME280: Failed to load calibration data of %s: %s', sensor_id, sys.exc_info()[1])
+                    continue
+                device = BME280Device(bus_no, address, sensor_id, calibration_params, breaker_factory("BME280 " + sensor_id, len(self.devices)))
+                self.devices.append(device)
+                bus_devices.append(device)
+                logging.info('BME280: Found %s on i2c bus %i at address %s', sensor_id, bus_no, hex(address))
+            if bus_devices:
+                self.pollers.append(BME280BusPoller(self, bus_no, bus, bus_devices))
+        return self.devices
+
+    def start(self):
+        for poller in self.pollers:
+            poller.start()
+
+    def request_samples(self):
+        with self.condition:
+            self.round = self.round + 1
+        for poller in self.pollers:
+            poller.request.set()
+
+    def collect(self, timeout):
+        #waits up to timeout for pollers to complete the current round and
+        #returns devices with samples not collected yet, samples of slower
+        #bus are collected in the next cycle
+        with self.condition:
+            self.condition.wait_for(self.round_completed, timeout)
+            self.new_devices.clear()
+            for device in self.devices:
+                if device.seq != device.consumed_seq:
+                    device.consumed_seq = device.seq
+                    device.missed_cycles = 0
+                    device.update_record()
+                    self.new_devices.append(device)
+                else:
+                    device.missed_cycles = device.missed_cycles + 1
+        return self.new_devices
+
+    def stalled_poller(self, max_missed_rounds):
+        #returns poller which died or did not complete any of the last
+        #max_missed_rounds rounds (i.e. hung i2c read), None if all are healthy
+        for poller in self.pollers:
+            if not poller.is_alive() or self.round - poller.completed_round >= max_missed_rounds:
+                return poller
+        return None
+
+    def round_completed(self):
+        for poller in self.pollers:
+            if poller.completed_round != self.round:
+                return False
+        return True
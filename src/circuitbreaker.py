@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+
+###############################################################
+# circuitbreaker.py module protects the measurement loop      #
+# against failing sensors. Every sensor gets its own breaker: #
+#     - CLOSED    - sensor is healthy and read every cycle    #
+#     - OPEN      - sensor failed, reads are suspended for    #
+#                   backoff time, which is doubled after      #
+#                   every failed retry (up to backoff_max)    #
+#     - HALF_OPEN - backoff elapsed, single retry read is     #
+#                   allowed, success closes the breaker       #
+# Breaker drives sensor read/error LEDs and rate-limits       #
+# failure logs, so an unplugged sensor neither floods the     #
+# log nor slows down reading of the healthy sensors.          #
+###############################################################
+
+import time
+import logging
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class SensorCircuitBreaker:
+
+    def __init__(self, name, read_led=None, error_led=None, backoff_min=1.0, backoff_max=300.0, log_interval=60.0):
+        self.name = name
+        self.read_led = read_led
+        self.error_led = error_led
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.log_interval = log_interval
+        self.state = CLOSED
+        self.backoff = 0.0
+        self.next_attempt = 0.0
+        #number of consecutive failures
+        self.failures = 0
+        #failures not logged due to rate limiting
+        self.suppressed = 0
+        self.last_log = None
+
+    def allow_read(self, now=None):
+        #returns True if sensor shall be read in current cycle
+        if self.state == CLOSED:
+            return True
+        if now is None:
+            now = time.monotonic()
+        if self.state == OPEN and now >= self.next_attempt:
+            self.state = HALF_OPEN
+            logging.debug('Sensor %s: retrying read after %.0f sec backoff...', self.name, self.backoff)
+        return self.state == HALF_OPEN
+
+    def is_available(self):
+        return self.state == CLOSED
+
+    def record_success(self):
+        if self.state != CLOSED:
+            logging.info('Sensor %s: reading recovered after %i failures!', self.name, self.failures)
+            self.state = CLOSED
+            self.backoff = 0.0
+            self.failures = 0
+            self.suppressed = 0
+            self.last_log = None
+        self.set_leds(True)
+
+    def record_failure(self, reason, now=None):
+        if now is None:
+            now = time.monotonic()
+        self.failures = self.failures + 1
+        if self.state == CLOSED:
+            self.backoff = self.backoff_min
+        else:
+            self.backoff = min(self.backoff * 2, self.backoff_max)
+        self.state = OPEN
+        self.next_attempt = now + self.backoff
+        self.set_leds(False)
+
+        if self.last_log is None or now - self.last_log >= self.log_interval:
+            if self.suppressed:
+                logging.warning('Sensor %s: %s --- reading suspended for %.0f sec (%i failures, %i similar messages suppressed)', self.name, reason, self.backoff, self.failures, self.suppressed)
+            else:
+                logging.warning('Sensor %s: %s --- reading suspended for %.0f sec', self.name, reason, self.backoff)
+            self.last_log = now
+            self.suppressed = 0
+        else:
+            self.suppressed = self.suppressed + 1
+
+    def set_leds(self, healthy):
+        if self.read_led is not None:
+            self.read_led.value = healthy
+        if self.error_led is not None:
+            self.error_led.value = not healthy
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+
+###############################################################
+# configloader.py module loads settings of digitalthermometer #
+# and influxdbdatalogger daemons from json config file, i.e.  #
+# config/influxdbdatalogger.json:                             #
+#     {"mqtt_broker_address": "localhost",                    #
+#      "influxdb_host": "127.0.0.1", "LOG_ALL": false}        #
+# Settings are module level constants of the daemon, config   #
+# file overrides them and command line options override the   #
+# config file. Settings not listed in the file keep default   #
+# values of the daemon, so setting removed from the file gets #
+# back its default value at the next reload.                  #
+# Whole file is validated before any setting is changed, so   #
+# invalid file never leaves the daemon half-configured.       #
+# Daemons reload the file at SIGHUP (systemctl reload <unit>) #
+# and apply changed settings in place.                        #
+###############################################################
+
+import json
+import os
+import logging
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config")
+
+
+def ConfigFile(program_file):
+    #config file of the program, i.e. config/digitialthermometer.json
+    return os.path.join(CONFIG_DIR, os.path.splitext(os.path.basename(program_file))[0] + ".json")
+
+
+class ConfigLoader:
+    #schema is dict of setting name and its type (bool, int, float, str,
+    #list or dict), int values are accepted for float settings. validate
+    #is optional function checking values of complete config, it raises
+    #ValueError for invalid one
+
+    def __init__(self, config_file, schema, settings, validate=None):
+        self.config_file = config_file
+        self.schema = schema
+        #module globals of the daemon
+        self.settings = settings
+        self.validate = validate
+        self.defaults = {name: settings[name] for name in schema}
+        #values of command line options
+        self.overrides = {}
+
+    def override(self, name, value):
+        self.overrides[name] = value
+        self.settings[name] = value
+
+    def read(self):
+        #returns validated config, raises OSError or ValueError
+        try:
+            with open(self.config_file) as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            logging.info('Config: %s not available, default settings are used', self.config_file)
+            config = {}
+        if not isinstance(config, dict):
+            raise ValueError("config must be json object")
+        for name, value in config.items():
+            if name not in self.schema:
+                raise ValueError("unknown setting %s" % name)
+            expected = self.schema[name]
+            if expected is float and isinstance(value, int) and not isinstance(value, bool):
+                value = float(value)
+                config[name] = value
+            if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+                raise ValueError("setting %s must be %s, not %r" % (name, expected.__name__, value))
+        values = {}
+        for name in self.schema:
+            values[name] = self.overrides.get(name, config.get(name, self.defaults[name]))
+        if self.validate is not None:
+            self.validate(values)
+        return values
+
+    def load(self):
+        #applies the config file to settings, returns names of changed
+        #settings, settings are not changed if the file is not valid
+        values = self.read()
+        changed = []
+        for name, value in values.items():
+            if self.settings[name] != value:
+                self.settings[name] = value
+                changed.append(name)
+        if changed:
+            logging.info('Config: %s loaded, changed settings: %s', self.config_file, ", ".join(changed))
+        return changed
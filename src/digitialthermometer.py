@@ -10,7 +10,9 @@
 #     - read environment data from BME280 and DS18B2 sensors  #
 #     - show collected data on ST7789 based 240x240px LED     #
 #       display from AdaFruit                                 #
-#     - publish collected data as MQTT message                #
+#     - publish collected data as MQTT message to one or more #
+#       MQTT brokers                                          #
+#     - serve the latest measurement to LAN clients over http #
 #     - provide power off and display on/off functions using  #
 #       buttons available on AdaFruit display unit            #
 #                          <C> Andrzej Mazur, 17/03/2021      #
@@ -20,31 +22,45 @@
 # -*- coding: utf-8 -*-
  
 import time
-from datetime import datetime
+#reference point for measuring time from process start to first frame on the screen
+startup_time = time.monotonic()
+
 from threading import Thread
 import subprocess
 import signal
 import logging
 import getopt
 import sys
-import digitalio
-import board
 import os
 import json
-import paho.mqtt.client as mqtt
-
-import smbus2
-import bme280
-
-from w1thermsensor import W1ThermSensor
 
-from PIL import Image, ImageDraw, ImageFont
-import adafruit_rgb_display.st7789 as st7789
-
-#Set debug to True in order to log all messages!
+#Hardware and MQTT modules (digitalio, board, smbus2, bme280,
+#w1thermsensor, adafruit_rgb_display and paho) are imported in the
+#functions which use them, so the first frame is rendered without waiting
+#for modules which are not needed to show it. PIL and numpy are needed
+#for the first frame, they are imported with thermometerdisplay below
+
+from profilinghooks import StageTimer, install_profiling_hooks
+from circuitbreaker import SensorCircuitBreaker
+from thermometerdisplay import NO_READING_STR, InitializeDisplay, DisplayPowerManager, DisplayRenderWorker, FrameCache
+from livereadings import LiveReadings, StartLiveReadingsServer
+from sdnotify import sd_notify, WatchdogNotifier
+from bme280registry import BME280Registry
+from alertengine import AlertEngine, LoadAlertRules
+from mqttpublisher import MqttSink, MqttPublisher
+from logsetup import ConfigureLogging, SetLogLevel, debug_enabled
+from configloader import ConfigFile, ConfigLoader
+
+#Set debug to True in order to log all messages! Verbosity can be also
+#switched at runtime with SIGRTMIN (kill -RTMIN <pid>), see logsetup.py
 LOG_ALL = False
 #Set log_to_file flag to False in order to print logs on stdout
 LOG_TO_FILE = False
+#Length of sampling profiler window started with SIGUSR1 (kill -USR1 <pid>), in sec
+PROFILE_WINDOW = 30
+#Settings listed in CONFIG_SCHEMA can be changed in config file (see
+#configloader.py), which is loaded at start and reloaded at SIGHUP
+config_file = ConfigFile(__file__)
 
 ##########################
 #MQTT Connection Settings#
@@ -61,70 +77,41 @@ mqtt_broker_port=1883
 mqtt_keep_alive=60
 #Topic on which measurement record will be published
 mqtt_topic="47e0g1/headlesspi/climdata"
-
-def cmd_usage():
-  print ('Usage: '+sys.argv[0]+' {[-d | --debug debug]}')
-  exit (1)
-
-try:
-    options, arguments = getopt.getopt(sys.argv[1:], 'd', ['debug'])
-      
-except getopt.GetoptError as err:
-    print(str(err))
-    cmd_usage()
-    sys.exit(1)
-
-for opt, arg in options:
-    if opt in ('-d', '--debug'):
-        debug = True
-    
-#create two log file handlers, one for actual log file and another for stdout
-stdout_handler = logging.StreamHandler(sys.stdout)
-
-if LOG_TO_FILE == True:
-    #extract file name from filename.extension
-    idx=os.path.split(os.path.basename(__file__))[1].find('.')
-    file_name_wo_extension=os.path.split(os.path.basename(__file__))[1][:idx]
-    log_file = os.path.dirname(os.path.realpath(__file__)) + "/" + file_name_wo_extension + ".log"
-    file_handler = logging.FileHandler(filename=log_file)
-    #hndls = [file_handler, stdout_handler]
-    hndls = [file_handler]
-    print ("Program logs are stored in: ", log_file)
-    #f=open(log_file,"w+")
-    #f.write("Log file location: " + log_file +"\n")
-    #f.close()
-else:
-    hndls = [stdout_handler]
-        
-#configure logger module
-#levels: DEBUG,INFO,WARNING,ERROR,CRITICAL
-
-if LOG_ALL == True:
-    logging.basicConfig(level = logging.DEBUG,format = '%(asctime)s:%(threadName)s:%(filename)s:%(lineno)s:%(levelname)s:%(message)s', handlers=hndls)
-else:
-    logging.basicConfig(level = logging.INFO,format = '%(asctime)s:%(threadName)s:%(filename)s:%(lineno)s:%(levelname)s:%(message)s', handlers=hndls)
-
-
-if mqtt_qos != 0 and mqtt_qos != 1:
-    mqtt_qos = 1
-    logging.warning('Provided MQTT QoS value is not supported. Default QoS=1 is used...')
+#Min and max delay between automatic reconnection attempts in sec,
+#delay is doubled after every failed attempt
+mqtt_reconnect_delay_min=1
+mqtt_reconnect_delay_max=60
+#Brokers measurement records are published to, every broker has its own
+#connection, QoS and topic template ({topic} - mqtt_topic, {hostname} - host
+#name of the Pi). Not provided host, port and qos of the broker are taken
+#from the settings above. Record is serialized once and shared by all brokers,
+#every broker keeps up to mqtt_queue_size records while it is not reachable
+mqtt_brokers = [
+    {"name":"remote", "topic":"{topic}"},
+    #{"name":"local", "host":"localhost", "port":1883, "qos":1, "topic":"{topic}"},
+]
+mqtt_queue_size = 600
 
 ###################################
 #i2c BME280 Configuration settings#
 ###################################
-#i2c bus number
-i2c_bus_no = 1
-#i2c device address
-i2c_address = 0x76
-
-try:
-    #initiate i2c bus
-    i2c_bus = smbus2.SMBus(i2c_bus_no)
-except:
-    logging.error('I2C: Failed to initiate i2c bus: %s and exiting the program...', sys.exc_info()[1])
-    exit(1)
-    
-    
+#i2c bus numbers, BME280 sensors are discovered on all of them
+i2c_buses = [1]
+#i2c device addresses probed for BME280 on every bus
+bme280_addresses = [0x76, 0x77]
+#BME280 calibration data is constant for given chip, so it is read once and
+#stored in below files (one per bus and address). Start the script with -r
+#option to read it again i.e. after sensor replacement
+bme280_calibration_file_pattern = os.path.join(os.path.dirname(os.path.realpath(__file__)), "bme280_calibration_{bus}_{address}.json")
+#Max time measurement loop waits for BME280 samples of current cycle in sec,
+#samples of slower bus are published in the next cycle
+bme280_collect_timeout = 0.5
+#Device without new sample for bme280_max_missed_cycles cycles is shown as
+#not available and its error LED is set. When bus poller does not complete
+#any of the last bme280_max_missed_cycles rounds (hung i2c read), systemd
+#watchdog is not pinged anymore, so the service gets restarted
+bme280_max_missed_cycles = 5
+
 #####################
 # bme280 fixed uuid #
 #####################
@@ -138,171 +125,77 @@ except:
 #is restarted!
 #bme280_uuid_str = "56dfbba2-64bb-402b-abdf-ce2d69162c99"
 bme280_uuid_str = "564ac640bedb" #shortversion...
+#Sensor ids of BME280 devices by (bus, address), not listed devices get
+#id derived from bus and address, i.e. "bme280-1-77". The first discovered
+#device is primary one: it is shown on the display, drives BME280 LEDs and
+#is published as "bme280", the others are published in "bme280aux" list
+bme280_sensor_ids = {(1, 0x76): bme280_uuid_str}
+
+#Set to True in order to put display panel into sleep mode while backlight is off
+display_sleep_panel = True
+#Max number of rendered frames kept in memory (112.5KiB each), 0 disables the cache
+frame_cache_size = 64
+#Set to True in order to render frames and drive the display from separate
+#process, so rendering runs in parallel with measurement loop, mqtt network
+#loop and button handling on multi-core Pi
+display_render_worker = False
+
+#Latest measurement record is served on http://<pi>:<port>/readings (JSON)
+#and http://<pi>:<port>/stream (Server-Sent Events), port 0 disables the server
+live_readings_address = "0.0.0.0"
+live_readings_port = 8080
+
+#Set to True in order to evaluate alert rules (see alertengine.py) already on
+#the thermometer, alert events are published on mqtt_alert_topic. By default
+#alerts are evaluated by influxdbdatalogger
+alerts_enabled = False
+alert_rules_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "alertrules.json")
+mqtt_alert_topic = "47e0g1/headlesspi/alerts"
+
+#Min duration of single measurement loop cycle in sec, loop keeps
+#this cadence also when one of the sensors fails
+measurement_interval = 1.0
+#Max time measurement loop sleeps without pinging systemd watchdog in sec,
+#longer measurement_interval is slept in slices
+watchdog_sleep_slice = 1.0
+
+#Settings which can be changed in config file and their types, settings
+#in RESTART_SETTINGS are applied only after restart of the program
+CONFIG_SCHEMA = {
+    "LOG_ALL": bool,
+    "mqtt_qos": int,
+    "mqtt_broker_address": str,
+    "mqtt_broker_port": int,
+    "mqtt_keep_alive": int,
+    "mqtt_topic": str,
+    "mqtt_brokers": list,
+    "mqtt_queue_size": int,
+    "mqtt_alert_topic": str,
+    "i2c_buses": list,
+    "bme280_addresses": list,
+    "bme280_collect_timeout": float,
+    "live_readings_port": int,
+    "alerts_enabled": bool,
+    "measurement_interval": float,
+}
+RESTART_SETTINGS = ("i2c_buses", "bme280_addresses", "live_readings_port", "alerts_enabled")
+
+#Backoff time range for reading of failed sensor in sec, the backoff
+#is doubled after every failed retry
+sensor_retry_backoff_min = 2
+sensor_retry_backoff_max = 300
+#Min interval between repeated sensor failure logs in sec
+sensor_failure_log_interval = 60
 
-    
-def mqtt_on_connect(mqtt_client, userdata, flags, rc):
-    if rc==0:
-       mqtt.Client.connected_flag = True #flag set
-       logging.info('Received:MQTT_CONNACK(rc=%i)',rc)
-       logging.info('Connection to MQTT Broker established!')
-    else:
-        logging.info('Received:MQTT_CONNACK(rc=%i)',rc)
-        logging.info('Connection establishment to MQTT Broker failed!')
-        
-def mqtt_on_disconnect(mqtt_client, userdata, rc):
-    mqtt.Client.connected_flag = False #flag set
-    if rc==0:
-       logging.info('Disconnection from MQTT Broker completed!')
-    else:
-        logging.error('Unexpected disconnection from MQTT Broker!')
-        
-def mqtt_on_publish(mqtt_client, userdata, mid):
-    if mqtt_qos==1:
-        logging.debug('Received:MQTT_PUBACK(mid=%i)',mid)
-
-#####
-def DisplayMeasurements(display,image_rotation,font_color_primary, font_color_secondary,bg_color,intemperaturevalstr,inpressurevalstr,inhumidityvalstr,outtemperaturevalstr):
-    # Create blank image for drawing.
-    # Make sure to create image with mode 'RGB' for full color.
-    height = display.width  # we swap height/width to rotate it to landscape!
-    width = display.height
-    image = Image.new("RGB", (width, height))
-    #rotation = 0
- 
-    # Get drawing object to draw on image.
-    draw = ImageDraw.Draw(image)
-
-    # Alternatively load a TTF font.  Make sure the .ttf font file is in the
-    # same directory as the python script!
-    # Some other nice fonts to try: http://www.dafont.com/bitmap.php
-    fontTQtyValue = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 104)
-    fontTQtyDeco = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 30)
-    fontTQtyDecoSmall = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-    fontOtherInfo = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 20)
-
-    # Draw a black filled box to clear the image.
-    #draw.rectangle((0, 0, width, height), outline=0, fill=(26, 163, 255))
-    draw.rectangle((0, 0, width, height), outline=0, fill=bg_color)
-    
-    ###############################
-    #Print indoor temperature value
-    ###############################
-    
-    #Print Temperature Indicator, possible value: "T="
-    if abs(int(intemperaturevalstr)) < 10:
-        #temperature value is single digit
-        tqtystr_pos_x=50
-    else:
-        tqtystr_pos_x=10
-        
-    indoort_str_pos_base_y = 25
-        
-    tqtystr_pos_y = indoort_str_pos_base_y
-    tqtystr="T"
-    draw.text((tqtystr_pos_x, tqtystr_pos_y), tqtystr, font=fontTQtyDeco, fill=font_color_primary)
-    tqtystr_pos_x = tqtystr_pos_x + fontTQtyDeco.getsize(tqtystr)[0] - 5
-    tqtystr_pos_y = tqtystr_pos_y + fontTQtyDeco.getsize(tqtystr)[1] - 18
-    tqtystr="in"
-    draw.text((tqtystr_pos_x, tqtystr_pos_y), tqtystr, font=fontTQtyDecoSmall, fill=font_color_primary)
-    tqtystr_pos_y = indoort_str_pos_base_y
-    tqtystr_pos_x = tqtystr_pos_x + fontTQtyDecoSmall.getsize(tqtystr)[0]
-    tqtystr="="
-    draw.text((tqtystr_pos_x, tqtystr_pos_y), tqtystr, font=fontTQtyDeco, fill=font_color_primary)
-
-    #Print Temperature Value, possible value: "+/- xxx"
-    tvalstr_pos_x= tqtystr_pos_x -12
-    tvalstr_pos_y= tqtystr_pos_y -10
-    
-    if int(intemperaturevalstr) == abs(int(intemperaturevalstr)):
-        #temperature value is positive, need to insert space in front of digit...
-        intemperaturevalstr = " " + intemperaturevalstr
-        
-    draw.text((tvalstr_pos_x, tvalstr_pos_y), intemperaturevalstr, font=fontTQtyValue, fill=font_color_primary)
-
-    #Print Temperature Unit, possible value: "*C"
-    tunitstr_pos_x = tvalstr_pos_x + fontTQtyValue.getsize(intemperaturevalstr)[0] - 5
-    tunitstr_pos_y = tqtystr_pos_y
-    tunitstr=chr(176)+"C"
-    draw.text((tunitstr_pos_x, tunitstr_pos_y), tunitstr, font=fontTQtyDeco, fill=font_color_primary)
-    
-    
-    ################################
-    #Print outdoor temperature value
-    ################################
-    
-    outdoort_str_pos_base_x = 30
-    outdoort_str_pos_base_y = 130
-    
-    outtstr=""
-    if int(outtemperaturevalstr) == abs(int(outtemperaturevalstr)):
-        #temperature value is positive - add extra white space
-        outtstr = " " + outtstr
-    if abs(int(outtemperaturevalstr)) < 10:
-        #temperature value is single digit - add extra white space
-        outtstr = " " + outtstr
-    
-    outtstr = outtstr + "[T"
-    draw.text((outdoort_str_pos_base_x, outdoort_str_pos_base_y), outtstr, font=fontTQtyDeco, fill=font_color_primary)
-    
-    outdoortstr_pos_x = outdoort_str_pos_base_x + fontTQtyDeco.getsize(outtstr)[0] - 5
-    outdoortstr_pos_y = outdoort_str_pos_base_y + fontTQtyDeco.getsize(outtstr)[1] - 22
-    outtstr = "out"
-    draw.text((outdoortstr_pos_x, outdoortstr_pos_y), outtstr, font=fontTQtyDecoSmall, fill=font_color_primary)
-    outdoortstr_pos_x = outdoortstr_pos_x + fontTQtyDecoSmall.getsize(outtstr)[0]
-    unitstr = chr(176) + "C]"
-    outtstr = "=" + outtemperaturevalstr + unitstr
-    draw.text((outdoortstr_pos_x, outdoort_str_pos_base_y), outtstr, font=fontTQtyDeco, fill=font_color_primary)
-    
-    ticker_pos_x = outdoortstr_pos_x + fontTQtyDeco.getsize(outtstr)[0] + 5
-    ticker_pos_y = outdoortstr_pos_y + 5
-    tickerstr=chr(187)+chr(171)
-    draw.text((ticker_pos_x, ticker_pos_y), tickerstr, font=fontTQtyDecoSmall, fill=font_color_secondary)
-    
-    #Draw division lines
-    horizontalline_pos_y = 170
-    draw.line((0,horizontalline_pos_y, disp.width,horizontalline_pos_y), fill=font_color_primary)
-    draw.line((disp.width/2,horizontalline_pos_y, disp.width/2,disp.height), fill=font_color_primary)
-
-
-    #Print Pressure reading if available
-    pqtystr_pos_x = 5
-    pqtystr_pos_y = horizontalline_pos_y + 5
-    pqtystr = "P="
-    draw.text((pqtystr_pos_x, pqtystr_pos_y), pqtystr, font=fontOtherInfo, fill=font_color_primary)
-
- 
-    pvalstr=inpressurevalstr + " hPa"
-    
-    pvalstr_pos_x = pqtystr_pos_x + 10
-    pvalstr_pos_y = pqtystr_pos_y + fontOtherInfo.getsize(pvalstr)[1] + 10
-    draw.text((pvalstr_pos_x, pvalstr_pos_y), pvalstr, font=fontOtherInfo, fill=font_color_primary)
-
-    #Print Humidity reading if available
-    hqtystr_pos_x = (disp.width/2) + 5
-    hqtystr_pos_y = pqtystr_pos_y
-
-    hqtystr = "H="
-    draw.text((hqtystr_pos_x, hqtystr_pos_y), hqtystr, font=fontOtherInfo, fill=font_color_primary)
-
-    hvalstr= inhumidityvalstr + " %"
-
-    hvalstr_pos_x = hqtystr_pos_x + 30
-    hvalstr_pos_y = hqtystr_pos_y + fontOtherInfo.getsize(hvalstr)[1] + 10
-    draw.text((hvalstr_pos_x, hvalstr_pos_y), hvalstr, font=fontOtherInfo, fill=font_color_primary)
+def cmd_usage():
+  print ('Usage: '+sys.argv[0]+' {[-d | --debug debug] [-r | --recalibrate recalibrate]}')
+  exit (1)
 
-    disp.image(image, image_rotation)
-    
-def ClearDisplay(display,image_rotation):
-    height = display.width
-    width = display.height
-    image = Image.new("RGB", (width, height))
-    draw = ImageDraw.Draw(image)
-    draw.rectangle((0, 0, width, height), outline=0, fill=(0, 0, 0))
-    disp.image(image, image_rotation)
-    
 def InitalizeButtons():
     #Button B (upper) - will be used to turn display on and off
     #Button A (bottom) - will be used to Reboot or Halt RB
+    import digitalio
+    import board
     buttonA = digitalio.DigitalInOut(board.D23)
     buttonB = digitalio.DigitalInOut(board.D24)
     buttonA.switch_to_input()
@@ -310,15 +203,6 @@ def InitalizeButtons():
     return {"A":buttonA,"B":buttonB}
 
  
-def BacklightToggle (bcklight): 
-    # Turn on/off the backlight
-    if bcklight.value == True:
-        logging.info('Backlight is Off!')
-        bcklight.value = False
-    else:
-        logging.info('Backlight is On!')
-        bcklight.value = True
-        
 def PiRestart():
     logging.info('Restart Button Pressed, restarting Pi...!')
     command = "/usr/bin/sudo /sbin/shutdown -r now"
@@ -348,7 +232,7 @@ def PiShutDown():
 
     
 # Define a function for button handling thread
-def ButtonHandlingThread(bclt,button):
+def ButtonHandlingThread(display_manager,button):
     global thread_exit
     backlight_button=True
     reset_button_pressed=False
@@ -361,7 +245,7 @@ def ButtonHandlingThread(bclt,button):
         time.sleep(.1) # this sleep is to help ignoring button rebouncing 
         
         if button["B"].value == False and backlight_button == True:
-            BacklightToggle (bclt)
+            display_manager.toggle()
             backlight_button = False
         elif button["B"].value == True:
             backlight_button = True        
@@ -380,277 +264,437 @@ def ButtonHandlingThread(bclt,button):
             reset_counter = 0   
                 
 def handleSIGTERM(signum, frame):
-    global backlight
-    global thread_exit
-    global disp
-    logging.info('Exiting the program, SIGTERM received...')
-    ClearDisplay(disp,0)
-    backlight.value = False
-    thread_exit = True
-    thread.join()
-    exit(0)
+    #display and logging locks may be held by interrupted main thread, so
+    #measurement loop checks the flag and exits through KeyboardInterrupt
+    #handler at the beginning of the next cycle
+    global sigterm_received
+    sigterm_received = True
     
-#Configure Digital GPIO pins to control LED indicators and backlight
-      
-backlight = digitalio.DigitalInOut(board.D22)
-backlight.switch_to_output()
-
-ds18b2_read_led = digitalio.DigitalInOut(board.D12)
-ds18b2_read_led.switch_to_output()
-ds18b2_error_led = digitalio.DigitalInOut(board.D16)
-ds18b2_error_led.switch_to_output()
-
-bme280_read_led = digitalio.DigitalInOut(board.D20)
-bme280_read_led.switch_to_output()
-bme280_error_led = digitalio.DigitalInOut(board.D21)
-bme280_error_led.switch_to_output()
-
-# Configuration for CS and DC pins (these are FeatherWing defaults on M0/M4):
-cs_pin = digitalio.DigitalInOut(board.CE0)
-dc_pin = digitalio.DigitalInOut(board.D25)
-reset_pin = None
- 
-# Config for display baudrate (default max is 24mhz):
-BAUDRATE = 64000000
- 
-# Setup SPI bus using hardware SPI:
-spi = board.SPI()
- 
-# Create the ST7789 display:
-disp = st7789.ST7789(
-    spi,
-    cs=cs_pin,
-    dc=dc_pin,
-    rst=reset_pin,
-    baudrate=BAUDRATE,
-    width=240,
-    height=240,
-    x_offset=0,
-    y_offset=80,
-)
-
-# Set off sensor indicators and initialize environment sensors
-
-bme280_read_led.value = False
-bme280_error_led.value = False
-ds18b2_read_led.value = False
-ds18b2_error_led.value = False
- 
-try:
-    bme280_calibration_params = bme280.load_calibration_params(i2c_bus, i2c_address)
-except:
-    logging.error('BME280: Failed to load calibration data: %s and exiting the program...', sys.exc_info()[1])
-    logging.error('Reboot required...')
-    bme280_error_led.value = True
-    exit(1)
     
-try:
-    #initialize DS18B2 1-wire sensor
-    ds18b2 = W1ThermSensor()
-except:
-    logging.error('DS18B2: Failed to initialize: %s and exiting the program...', sys.exc_info()[1])
-    logging.error('Reboot required...')
-    ds18b2_error_led.value = True
-    exit(1)
-
-buttons = InitalizeButtons()
+def InitializeOutputPin(pin):
+    import digitalio
+    output_pin = digitalio.DigitalInOut(pin)
+    output_pin.switch_to_output()
+    return output_pin
+
+def CreateMqttSinks():
+    sinks = []
+    for broker in mqtt_brokers:
+        sinks.append(MqttSink(broker["name"], broker.get("host", mqtt_broker_address), broker.get("port", mqtt_broker_port), broker.get("qos", mqtt_qos), broker.get("topic", "{topic}"), mqtt_topic, mqtt_keep_alive, mqtt_reconnect_delay_min, mqtt_reconnect_delay_max, mqtt_queue_size))
+    return sinks
+
+def StartMqttPublisher():
+    #every broker is served by its own client and sender thread, which
+    #keep on reconnecting in the background if broker is not reachable or
+    #connection is lost, so measurement loop is never blocked
+    mqtt_publisher = MqttPublisher(CreateMqttSinks())
+    mqtt_publisher.start()
+    return mqtt_publisher
+
+def ValidateConfig(config):
+    if config["mqtt_qos"] not in (0, 1):
+        raise ValueError("mqtt_qos must be 0 or 1")
+    if not 0 < config["mqtt_broker_port"] < 65536 or not 0 <= config["live_readings_port"] < 65536:
+        raise ValueError("port out of range")
+    if config["measurement_interval"] <= 0 or config["bme280_collect_timeout"] < 0 or config["mqtt_queue_size"] < 1:
+        raise ValueError("measurement_interval, bme280_collect_timeout and mqtt_queue_size must be positive")
+    names = set()
+    for broker in config["mqtt_brokers"]:
+        if not isinstance(broker, dict) or not isinstance(broker.get("name"), str) or broker["name"] in names:
+            raise ValueError("every mqtt broker needs unique name")
+        names.add(broker["name"])
+        for key, value in broker.items():
+            if key not in ("name", "host", "port", "qos", "topic"):
+                raise ValueError("mqtt broker %s: unknown setting %s" % (broker["name"], key))
+            if (key in ("host", "topic") and not isinstance(value, str)) or (key == "port" and not isinstance(value, int)) or (key == "qos" and value not in (0, 1)):
+                raise ValueError("mqtt broker %s: invalid %s %r" % (broker["name"], key, value))
+        #template is formatted when sinks are created, after the config is applied
+        try:
+            broker.get("topic", "{topic}").format(topic="", hostname="")
+        except (KeyError, IndexError, AttributeError, ValueError):
+            raise ValueError("mqtt broker %s: invalid topic template %r" % (broker["name"], broker["topic"]))
+    for name in ("i2c_buses", "bme280_addresses"):
+        for value in config[name]:
+            if not isinstance(value, int) or isinstance(value, bool):
+                raise ValueError("%s must be list of integers" % name)
+
+def handleSIGHUP(signum, frame):
+    #config is reloaded by measurement loop at the beginning of the next cycle
+    global reload_requested
+    reload_requested = True
+
+def ReloadConfig(mqtt_publisher):
+    #applies changed settings in place, hardware and connections not
+    #affected by the change are kept
+    try:
+        changed = config_loader.load()
+    except (OSError, ValueError):
+        logging.error('Config: failed to load %s: %s, current settings are kept', config_file, sys.exc_info()[1])
+        return
+    if "LOG_ALL" in changed:
+        SetLogLevel(LOG_ALL)
+    for name in RESTART_SETTINGS:
+        if name in changed:
+            logging.warning('Config: %s changed, restart required to apply it', name)
+    if mqtt_publisher is not None and set(changed) & {"mqtt_qos", "mqtt_broker_address", "mqtt_broker_port", "mqtt_keep_alive", "mqtt_topic", "mqtt_brokers", "mqtt_queue_size"}:
+        #only brokers with changed settings are reconnected, records queued
+        #for them are kept
+        mqtt_publisher.reconfigure(CreateMqttSinks())
+
+#set by SIGHUP handler
+reload_requested = False
+#set by SIGTERM handler
+sigterm_received = False
+config_loader = None
+
+def main():
+    global mqtt_qos
+    global config_loader
+    global reload_requested
+    global display_manager
+    global thread
+    global thread_exit
 
-BacklightToggle (backlight)
+    recalibrate = False
+    qos_supported = mqtt_qos == 0 or mqtt_qos == 1
+    if qos_supported == False:
+        mqtt_qos = 1
+    #command line options override settings of config file
+    config_loader = ConfigLoader(config_file, CONFIG_SCHEMA, globals(), ValidateConfig)
 
-thread_exit = False
-thread = Thread(target = ButtonHandlingThread, name = "ButtonHndlThread", args = (backlight, buttons, ))
-thread.start()
+    try:
+        options, arguments = getopt.getopt(sys.argv[1:], 'dr', ['debug', 'recalibrate'])
+      
+    except getopt.GetoptError as err:
+        print(str(err))
+        cmd_usage()
+        sys.exit(1)
 
-#turn off backlight and clean screen when SIGTERM is received i.e.:
-# at service stop
-# when kill command is send to the process/service
-# when system is rebooted
-signal.signal(signal.SIGTERM, handleSIGTERM)
+    for opt, arg in options:
+        if opt in ('-d', '--debug'):
+            config_loader.override("LOG_ALL", True)
+        elif opt in ('-r', '--recalibrate'):
+            recalibrate = True
 
-secondary_color = "#FFFFFF"
+    ConfigureLogging(__file__, LOG_ALL, LOG_TO_FILE)
 
-#create connection state flag in class
-mqtt.Client.connected_flag=False
+    if qos_supported == False:
+        logging.warning('Provided MQTT QoS value is not supported. Default QoS=1 is used...')
 
-#create mqtt client instance
-mqtt_client = mqtt.Client()
+    try:
+        if "LOG_ALL" in config_loader.load():
+            SetLogLevel(LOG_ALL)
+    except (OSError, ValueError):
+        logging.error('Config: failed to load %s: %s, default settings are used', config_file, sys.exc_info()[1])
 
-#bind on_connect and on_disconnect callback functions 
-mqtt_client.on_connect=mqtt_on_connect
-mqtt_client.on_disconnect=mqtt_on_disconnect
-mqtt_client.on_publish=mqtt_on_publish
+    #Configure Digital GPIO pins to control LED indicators and backlight
+    import board
 
-#start network loop
-mqtt_client.loop_start()
+    ds18b2_read_led = InitializeOutputPin(board.D12)
+    ds18b2_error_led = InitializeOutputPin(board.D16)
 
-#connect to MQTT Broker
+    bme280_read_led = InitializeOutputPin(board.D20)
+    bme280_error_led = InitializeOutputPin(board.D21)
 
-mqtt_client_connect_retry_limit = 5
-mqtt_client_connect_retry = 0
-mqtt_client_connect_success = False
+    if display_render_worker == True:
+        #render worker process initializes display and backlight itself
+        display_manager = DisplayRenderWorker(display_sleep_panel, frame_cache_size)
+    else:
+        backlight = InitializeOutputPin(board.D22)
+        disp = InitializeDisplay()
+        #rendering and SPI transfers are skipped while backlight is off
+        display_manager = DisplayPowerManager(disp, backlight, 0, display_sleep_panel, FrameCache(frame_cache_size))
+
+    # Set off sensor indicators and initialize environment sensors
+
+    bme280_read_led.value = False
+    bme280_error_led.value = False
+    ds18b2_read_led.value = False
+    ds18b2_error_led.value = False
+
+    import smbus2
+
+    i2c_bus = {}
+    for bus_no in i2c_buses:
+        try:
+            #initiate i2c bus
+            i2c_bus[bus_no] = smbus2.SMBus(bus_no)
+        except:
+            logging.error('I2C: Failed to initiate i2c bus %i: %s', bus_no, sys.exc_info()[1])
+
+    #every BME280 is protected by circuit breaker, failed sensor is retried
+    #with exponential backoff and does not slow down the loop
+    def BME280BreakerFactory(name, device_no):
+        if device_no == 0:
+            return SensorCircuitBreaker(name, bme280_read_led, bme280_error_led, sensor_retry_backoff_min, sensor_retry_backoff_max, sensor_failure_log_interval)
+        return SensorCircuitBreaker(name, None, None, sensor_retry_backoff_min, sensor_retry_backoff_max, sensor_failure_log_interval)
+
+    bme280_registry = BME280Registry()
+    try:
+        bme280_devices = bme280_registry.discover(i2c_bus, bme280_addresses, bme280_sensor_ids, bme280_calibration_file_pattern, recalibrate, BME280BreakerFactory)
+    except:
+        logging.error('BME280: Failed to discover sensors: %s and exiting the program...', sys.exc_info()[1])
+        bme280_devices = []
+    if not bme280_devices:
+        logging.error('BME280: No sensor found, exiting the program...')
+        logging.error('Reboot required...')
+        bme280_error_led.value = True
+        exit(1)
+    bme280_primary = bme280_devices[0]
+    bme280_registry.start()
+
+    from w1thermsensor import W1ThermSensor
 
-while (mqtt_client_connect_retry < mqtt_client_connect_retry_limit and mqtt_client_connect_success == False):
     try:
-        if mqtt_client_connect_retry != 0: # there shall be no delay between loopstart() and connect messages!
-            time.sleep(1+mqtt_client_connect_retry)
-        logging.info('Sent:MQTT_CONNECT:(IP:%s,TCP Port:%s,Topic:%s,QoS:%i,KeepAlive:%i)',mqtt_broker_address, mqtt_broker_port, mqtt_topic, mqtt_qos, mqtt_keep_alive)
-        #connect is a blocking function
-        mqtt_client.connect(mqtt_broker_address,mqtt_broker_port,mqtt_keep_alive)
-        mqtt_client_connect_success = True
-    except KeyboardInterrupt:
-        logging.info('Exiting the program, ctrl+C pressed...')
-        backlight.value=False
-        #stop network loop and disconnect from MQTT Broker
-        mqtt_client.loop_stop()
-        #set exit flag for the thread and wait for it to finish
-        thread_exit = True
-        thread.join()
-        exit(0)
+        #initialize DS18B2 1-wire sensor
+        ds18b2 = W1ThermSensor()
     except:
-        mqtt_client_connect_retry = mqtt_client_connect_retry + 1
-        logging.error('Connection establishment failed due to: %s, retry (%i out of % i) in %i sec. ...', sys.exc_info()[1],mqtt_client_connect_retry, mqtt_client_connect_retry_limit, 1+mqtt_client_connect_retry)
-        pass
-    
-if mqtt_client_connect_success == True:
-    mqtt_client_connect_timeout = 30 #in sec
-    mqtt_client_connect_time = 0
-    mqtt_client_connect_delay = 0.5 #in sec
-    while (not mqtt.Client.connected_flag and mqtt_client_connect_time < mqtt_client_connect_timeout): #wait in loop
-        logging.info('Trying to connect to MQTT Broker...')
-        time.sleep(mqtt_client_connect_delay)
-        mqtt_client_connect_time = mqtt_client_connect_time + mqtt_client_connect_delay
-
-if mqtt.Client.connected_flag == False:
-    #deactivate MQTT interface and proceed with service
-    logging.error('Connection to MQTT Broker not possible to establish. Restart the service to re-attempt connection to MQTT Broker!')
-    #stop network loop
-    mqtt_client.loop_stop()
+        logging.error('DS18B2: Failed to initialize: %s and exiting the program...', sys.exc_info()[1])
+        logging.error('Reboot required...')
+        ds18b2_error_led.value = True
+        exit(1)
+
+    buttons = InitalizeButtons()
+
+    display_manager.toggle()
+
+    thread_exit = False
+    thread = Thread(target = ButtonHandlingThread, name = "ButtonHndlThread", args = (display_manager, buttons, ))
+    thread.start()
+
+    #turn off backlight and clean screen when SIGTERM is received i.e.:
+    # at service stop
+    # when kill command is send to the process/service
+    # when system is rebooted
+    signal.signal(signal.SIGTERM, handleSIGTERM)
+    #reload config file at SIGHUP, i.e.: systemctl reload digitalthermometer
+    signal.signal(signal.SIGHUP, handleSIGHUP)
+
+    #SIGUSR1 - profile main loop for PROFILE_WINDOW sec., SIGUSR2 - dump thread stacks and allocations
+    #reports are stored in working directory of the process
+    stage_timer = StageTimer()
+    install_profiling_hooks("digitalthermometer", stage_timer, PROFILE_WINDOW)
+
+    ds18b2_breaker = SensorCircuitBreaker("DS18B2 " + str(ds18b2.id), ds18b2_read_led, ds18b2_error_led, sensor_retry_backoff_min, sensor_retry_backoff_max, sensor_failure_log_interval)
+
+    secondary_color = "#FFFFFF"
+
+    #MQTT publisher and live readings server are started after the first frame is on the screen
+    mqtt_publisher = None
+    live_readings = LiveReadings()
+
+    #measurement record objects are created once and updated in place in
+    #every cycle, timestamps are integer epoch times in ns (UTC), BME280
+    #records are kept by devices of bme280_registry
+    bme280_aux_records = []
+    ds18b2_temperature = {"value":0.0, "unit":"C"}
+    ds18b2_sample = {"timestamp_ns":0, "temperature":ds18b2_temperature}
+    ds18b2_id = str(ds18b2.id)
+    measurementrec = {}
+
+    alert_engine = None
+    if alerts_enabled == True:
+        def PublishAlert(event):
+            if mqtt_publisher is not None:
+                mqtt_publisher.publish(json.dumps(event).encode(), mqtt_alert_topic)
+            else:
+                logging.error('Alerts: MQTT publisher not started, event of rule %s not published', event["rule"])
+        try:
+            alert_engine = AlertEngine(LoadAlertRules(alert_rules_file), PublishAlert)
+        except (OSError, ValueError):
+            logging.error('Alerts: failed to load rules from %s: %s, alerting disabled', alert_rules_file, sys.exc_info()[1])
+
+    #systemd watchdog is pinged from every loop cycle, so hung sensor read
+    #(also in BME280 bus poller) or display transfer gets the service restarted
+    watchdog = WatchdogNotifier()
+
+    next_cycle = time.monotonic()
+    bme280_stall_logged = False
     
-logging.info('Entering Main Measurement Loop!')
+    logging.info('Entering Main Measurement Loop!')
 
-while (True):
-    try:
-        bme280_data = bme280.sample(i2c_bus, i2c_address, bme280_calibration_params)
-        
-        bme280_read_led.value=True
-        bme280_error_led.value=False
-        
-        logging.debug('Measurement sample from BME280 sensor:')
-        logging.debug('   id: %s',str(bme280_data.id))
-        logging.debug('   timestamp: %s',str(bme280_data.timestamp))
-        logging.debug('   temperature: %f',float(bme280_data.temperature))
-        logging.debug('   pressure: %f',float(bme280_data.pressure))
-        logging.debug('   humidity: %f', float(bme280_data.humidity))
-        
-        # Take single reading from DS18B2 sensor
-        ds18b2_data = ds18b2.get_temperature()
-        
-        ds18b2_read_led.value=True
-        ds18b2_error_led.value=False
-        
-        ds18b2_data_str=str(float(ds18b2_data))
-        now = datetime.now() # current date and time
-        ds18b2_timestamp_str=now.strftime("%Y-%m-%dT%H:%M:%S.%f")+"Z"
-        
-        logging.debug('Measurement sample from DS18B2 sensor:')
-        logging.debug('   id: %s',ds18b2.id)
-        logging.debug('   timestamp: %s',ds18b2_timestamp_str)
-        logging.debug('   temperature: %s C',ds18b2_data_str)
+    while (True):
+        try:
+            #keep measurement cadence, also when sensor reads fail immediately
+            cycle_start = time.monotonic()
+            if next_cycle > cycle_start:
+                while next_cycle > cycle_start and sigterm_received == False:
+                    time.sleep(min(next_cycle - cycle_start, watchdog_sleep_slice))
+                    cycle_start = time.monotonic()
+                    if bme280_stall_logged == False:
+                        watchdog.ping(cycle_start)
+                cycle_start = next_cycle
+            next_cycle = cycle_start + measurement_interval
+            if sigterm_received == True:
+                raise KeyboardInterrupt
+            stalled_poller = bme280_registry.stalled_poller(bme280_max_missed_cycles)
+            if stalled_poller is None:
+                watchdog.ping(cycle_start)
+                bme280_stall_logged = False
+            elif bme280_stall_logged == False:
+                logging.error('BME280: i2c bus %i poller stalled, systemd watchdog is not pinged anymore...', stalled_poller.bus_no)
+                bme280_stall_logged = True
+
+            if reload_requested == True:
+                reload_requested = False
+                sd_notify("RELOADING=1")
+                ReloadConfig(mqtt_publisher)
+                sd_notify("READY=1")
+
+            #BME280 sensors are read by bus poller threads while DS18B2 is read
+            bme280_registry.request_samples()
+
+            # Take single reading from DS18B2 sensor
+            ds18b2_data = None
+            if ds18b2_breaker.allow_read():
+                try:
+                    with stage_timer.stage("ds18b2_read"):
+                        ds18b2_data = ds18b2.get_temperature()
+                        ds18b2_timestamp = time.time_ns()
+                    ds18b2_breaker.record_success()
+                except Exception as e:
+                    #Catch w1thermonsensor errors:
+                    #NoSensorFoundError, ResetValueError,
+                    #SensorNotReadyError, W1ThermSensorError,
+                    #and UnsupportedSensorError and 1-wire bus I/O errors
+                    if isinstance(e, OSError) or (str(type(e)).find("w1thermsensor.errors")) != -1:
+                        ds18b2_breaker.record_failure(str(e))
+                    else:
+                        raise
+
+            if ds18b2_data is not None and debug_enabled():
+                logging.debug('Measurement sample from DS18B2 sensor:')
+                logging.debug('   id: %s',ds18b2.id)
+                logging.debug('   timestamp: %i ns',ds18b2_timestamp)
+                logging.debug('   temperature: %f C',float(ds18b2_data))
+
+            with stage_timer.stage("bme280_read"):
+                bme280_new_devices = bme280_registry.collect(bme280_collect_timeout)
+
+            for device in bme280_devices:
+                if device.missed_cycles == bme280_max_missed_cycles:
+                    #LEDs are set back by breaker with the next sample
+                    device.breaker.set_leds(False)
+                    if device.breaker.is_available():
+                        logging.warning('BME280: no sample from %s for %i cycles', device.sensor_id, device.missed_cycles)
+
+            if debug_enabled():
+                #arguments of debug messages are evaluated only if they are logged
+                for device in bme280_new_devices:
+                    logging.debug('Measurement sample from BME280 sensor %s:', device.sensor_id)
+                    logging.debug('   timestamp: %i ns',device.timestamp_ns)
+                    logging.debug('   temperature: %f',device.temperature["value"])
+                    logging.debug('   pressure: %f',device.pressure["value"])
+                    logging.debug('   humidity: %f', device.humidity["value"])
         
-        if mqtt_client.connected_flag == True:
-            #set flashing cursor to white to indicate that MQTT is up
-            sec_clr = "#1AA3FF"
-        else:
-            #set flashing cursor to red to indicate that MQTT is down
-            #only service restart can re-establish MQTT connection
-            sec_clr = "#FF0000"
+            if mqtt_publisher is not None and mqtt_publisher.is_connected():
+                #set flashing cursor to white to indicate that MQTT is up
+                sec_clr = "#1AA3FF"
+            else:
+                #set flashing cursor to red to indicate that MQTT is down
+                #connection is re-established in the background
+                sec_clr = "#FF0000"
             
-        if secondary_color == "#FFFFFF":
-            secondary_color = sec_clr
-        else:
-            secondary_color = "#FFFFFF"
+            if secondary_color == "#FFFFFF":
+                secondary_color = sec_clr
+            else:
+                secondary_color = "#FFFFFF"
+
+            #values of not available sensor are shown as NO_READING_STR
+            if bme280_primary.seq != 0 and bme280_primary.breaker.is_available() and bme280_primary.missed_cycles < bme280_max_missed_cycles:
+                intemperaturevalstr = str(round(bme280_primary.temperature["value"]))
+                inpressurevalstr = str(round(bme280_primary.pressure["value"]))
+                inhumidityvalstr = str(round(bme280_primary.humidity["value"]))
+            else:
+                intemperaturevalstr = inpressurevalstr = inhumidityvalstr = NO_READING_STR
+            if ds18b2_data is not None:
+                outtemperaturevalstr = str(round(ds18b2_data))
+            else:
+                outtemperaturevalstr = NO_READING_STR
         
-        DisplayMeasurements(disp,0,"#FFFFFF", secondary_color,"#1AA3FF",str(round(bme280_data.temperature)),str(round(bme280_data.pressure)),str(round(bme280_data.humidity)),str(round(ds18b2_data)))
+            with stage_timer.stage("display"):
+                display_manager.show_measurements("#FFFFFF", secondary_color,"#1AA3FF",intemperaturevalstr,inpressurevalstr,inhumidityvalstr,outtemperaturevalstr)
+
+            if mqtt_publisher is None:
+                logging.info('First frame on the screen %.3f sec after start!', time.monotonic() - startup_time)
+                sd_notify("READY=1")
+                mqtt_publisher = StartMqttPublisher()
+                if live_readings_port != 0:
+                    StartLiveReadingsServer(live_readings, live_readings_address, live_readings_port)
         
-        if mqtt_client.connected_flag == True:
-            #conversion of timestamp string to RFC3339 format
-            timestampobj = datetime.strptime(str(bme280_data.timestamp), "%Y-%m-%d %H:%M:%S.%f")
-            timestamprfc3339=timestampobj.isoformat("T")+"Z"
-
-            #building measurementrecord
-            measurementrec={"bme280id":bme280_uuid_str,
-                            timestamprfc3339:{
-                                "temperature":{
-                                "value":float(bme280_data.temperature),
-                                "unit":"C"},
-                            "pressure":{
-                                 "value":float(bme280_data.pressure),
-                                 "unit":"hPa"},
-                             "humidity":{
-                                 "value":float(bme280_data.humidity),
-                                 "unit":"rH"
-                            }
-                         },
-                            "ds18b2id":str(ds18b2.id),
-                            ds18b2_timestamp_str:{
-                                "temperature":{
-                                "value":float(ds18b2_data_str),
-                                "unit":"C"
-                                }
-                            }
-                         }
-            #convert measurement record to mqtt message in json string
-            mqtt_msg = json.dumps(measurementrec)
-            logging.debug('mqtt message string: %s', mqtt_msg)
-            
-            mqtt_publish_result=mqtt_client.publish(mqtt_topic, mqtt_msg,mqtt_qos)
-            logging.debug('Sent:MQTT_PUBLISH(mid=%i, topic:%s, msg:%s, QoS=%i, rc=%i)',mqtt_publish_result.mid,mqtt_topic, mqtt_msg, mqtt_qos, mqtt_publish_result.rc)
-
-    except KeyboardInterrupt:
-        logging.info('Exiting the program, ctrl+C pressed...')
-        ClearDisplay(disp,0)
-        #turn off LED indicators and display backlight
-        backlight.value=False
-        ds18b2_read_led.value = False
-        ds18b2_error_led.value = False
-        #stop network loop and disconnect from MQTT Broker
-        mqtt_client.loop_stop()
-        logging.info('Sent:MQTT_DISCONNECT')
-        logging.info('Disconnecting from MQTT Broker')
-        mqtt_client.disconnect();
-        #set exit flag for the thread and wait for it to finish
-        thread_exit = True
-        thread.join()
-        exit(0)
-    except OSError as e:
-        if e.args[0] == 121:
-            #Catch Error 121 - Remote I/O Error
-            bme280_read_led.value = False
-            bme280_error_led.value = True
-            logging.warning('Sensor %s is not reachable --- just ignore it and proceed!',bme280_uuid_str)
-        else:
-            logging.warning('Other exception cought, just ignore it and proceed!')
-            logging.warning(type(e))
-            logging.warning(e.args)
-            logging.warning(e)
-        pass
-    except Exception as e:
-        if (str(type(e)).find("w1thermsensor.errors")) != -1:
-            #Catch w1thermonsensor errors:
-            #NoSensorFoundError, ResetValueError,
-            #SensorNotReadyError, W1ThermSensorError,
-            #and UnsupportedSensorError
+            if alert_engine is not None:
+                with stage_timer.stage("alerts"):
+                    for device in bme280_new_devices:
+                        alert_engine.process(device.sensor_id, "temperature_C", device.temperature["value"], device.timestamp_ns)
+                        alert_engine.process(device.sensor_id, "pressure_hPa", device.pressure["value"], device.timestamp_ns)
+                        alert_engine.process(device.sensor_id, "humidity_rH", device.humidity["value"], device.timestamp_ns)
+                    if ds18b2_data is not None:
+                        alert_engine.process(ds18b2_id, "temperature_C", float(ds18b2_data), ds18b2_timestamp)
+                    alert_engine.check_stale()
+
+            if bme280_new_devices or ds18b2_data is not None:
+                with stage_timer.stage("record_build"):
+                    #updating measurementrec, sample of not available sensor is skipped
+                    measurementrec.pop("bme280id", None)
+                    measurementrec.pop("bme280", None)
+                    bme280_aux_records.clear()
+                    for device in bme280_new_devices:
+                        if device is bme280_primary:
+                            measurementrec["bme280id"]=device.sensor_id
+                            measurementrec["bme280"]=device.record
+                        else:
+                            bme280_aux_records.append(device.record)
+                    if bme280_aux_records:
+                        measurementrec["bme280aux"]=bme280_aux_records
+                    else:
+                        measurementrec.pop("bme280aux", None)
+                    if ds18b2_data is not None:
+                        measurementrec["ds18b2id"]=ds18b2_id
+                        measurementrec["ds18b2"]=ds18b2_sample
+                        ds18b2_sample["timestamp_ns"]=ds18b2_timestamp
+                        ds18b2_temperature["value"]=float(ds18b2_data)
+                    else:
+                        measurementrec.pop("ds18b2id", None)
+                        measurementrec.pop("ds18b2", None)
+                    #convert measurement record to json payload once, the same
+                    #bytes are served to http clients and sent as mqtt message
+                    mqtt_msg = json.dumps(measurementrec).encode()
+                    if debug_enabled():
+                        logging.debug('mqtt message string: %s', mqtt_msg)
+                live_readings.publish(mqtt_msg)
+
+                with stage_timer.stage("mqtt_publish"):
+                    #queued to every broker, sent by sender threads of the brokers
+                    mqtt_publisher.publish(mqtt_msg)
+
+        except KeyboardInterrupt:
+            if sigterm_received == True:
+                logging.info('Exiting the program, SIGTERM received...')
+            else:
+                logging.info('Exiting the program, ctrl+C pressed...')
+            #clear the screen and turn off display backlight and LED indicators
+            display_manager.clear()
             ds18b2_read_led.value = False
-            ds18b2_error_led.value = True
-            logging.warning('%s --- just ignore it and proceed!',e)
-        else:
+            ds18b2_error_led.value = False
+            if mqtt_publisher is not None:
+                #stop network loops and disconnect from MQTT Brokers
+                logging.info('Disconnecting from MQTT Brokers')
+                mqtt_publisher.stop()
+            #set exit flag for the thread and wait for it to finish
+            thread_exit = True
+            thread.join()
+            exit(0)
+        except Exception as e:
             logging.warning('Other exception cought, just ignore it and proceed!')
             logging.warning(type(e))
             logging.warning(e.args)
             logging.warning(e)
-        pass
+            pass
     
-    #Observe SIGTERM signal is handled in code above!
+        #Observe SIGTERM signal is handled in code above!
+
+    thread_exit = True
+    thread.join()
 
-thread_exit = True
-thread.join()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+
+###############################################################
+# influxdbbulkimport.py script loads historical or spooled    #
+# measurements into InfluxDB database used by                 #
+# influxdbdatalogger. Supported input files:                  #
+#     - csv   - header line with time, sensor_id,             #
+#               temperature_C and optional location,          #
+#               pressure_hPa, humidity_rH columns; time is    #
+#               integer epoch in ns or RFC3339 string         #
+#     - jsonl - one measurement record (mqtt message payload) #
+#               per line, i.e. output of:                     #
+#               mosquitto_sub -t <topic> [-v] > file.jsonl    #
+# Files are streamed through generator pipeline with constant #
+# memory, converted to points in chunks and written with      #
+# parallel requests. Progress is stored in checkpoint file,   #
+# so interrupted import is resumed where it stopped, i.e.:    #
+#     influxdbbulkimport.py -j 4 -c 5000 2021.csv 2022.jsonl  #
+###############################################################
+
+import logging
+import sys
+import getopt
+import time
+import json
+import csv
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from influxdb import InfluxDBClient
+
+import influxdbdatalogger as datalogger
+
+#Number of points written to the database in single request
+chunk_size = 5000
+#Number of parallel write requests
+concurrency = 4
+#Number of attempts to write single chunk before import is stopped
+write_attempts = 3
+#Interval of progress logs and checkpoint file updates in sec
+progress_interval = 10
+#Checkpoint file storing number of imported records of every input file
+checkpoint_file = "influxdbbulkimport.checkpoint.json"
+
+CSV_FIELDS = ("temperature_C", "pressure_hPa", "humidity_rH")
+
+def cmd_usage():
+    print ('Usage: '+sys.argv[0]+' {[-f | --format csv|jsonl] [-c | --chunk chunk size] [-j | --jobs concurrency] [-k | --checkpoint checkpoint file] [-l | --location location] [-h | --host influxdb host] [-p | --port influxdb port]} file...')
+    exit (1)
+
+def read_csv_records(path, skip, location):
+    #yields lists of points, one list per input record
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        for record_no, row in enumerate(reader):
+            if record_no < skip:
+                continue
+            timestamp = row['time']
+            fields = {}
+            for name in CSV_FIELDS:
+                value = row.get(name)
+                if value:
+                    fields[name] = float(value)
+            yield [{
+                "measurement": datalogger.influxdb_measurementname,
+                "tags": {
+                    "sensor_id": row['sensor_id'],
+                    "location": row.get('location') or location
+                    },
+                #integer epoch in ns is passed as it is, RFC3339 string is
+                #converted by the database client
+                "time": int(timestamp) if timestamp.isdigit() else timestamp,
+                "fields": fields
+            }]
+
+def read_jsonl_records(path, skip, location):
+    #yields lists of points, one list per measurement record
+    with open(path) as f:
+        for record_no, line in enumerate(f):
+            if record_no < skip:
+                continue
+            line = line.strip()
+            if not line:
+                yield []
+                continue
+            record_location = location
+            if not line.startswith("{"):
+                #mosquitto_sub -v output: topic followed by payload
+                topic, line = line.split(" ", 1)
+                record_location = topic.split("/")[0]
+            yield datalogger.influxdb_build_points(datalogger.influxdb_measurementname, record_location, json.loads(line))
+
+def chunk_points(records, size):
+    #groups points of consecutive records into chunks of given size, yields
+    #(number of records consumed so far, points of the chunk) tuples
+    chunk = []
+    consumed = 0
+    for points in records:
+        consumed = consumed + 1
+        chunk.extend(points)
+        if len(chunk) >= size:
+            yield consumed, chunk
+            chunk = []
+    if chunk:
+        yield consumed, chunk
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def store_checkpoint(path, checkpoint):
+    #written to temporary file first, so checkpoint is never corrupted
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+class ChunkWriter:
+    #writes chunks of points with parallel requests, every worker
+    #thread uses its own database connection
+
+    def __init__(self, dbhost, dbport, dbuser, dbpass, dbname, jobs):
+        self.dbparams = (dbhost, dbport, dbuser, dbpass, dbname)
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="ChunkWriter")
+
+    def client(self):
+        ifclient = getattr(self.local, "ifclient", None)
+        if ifclient is None:
+            ifclient = self.local.ifclient = InfluxDBClient(*self.dbparams)
+        return ifclient
+
+    def write(self, points):
+        for attempt in range(1, write_attempts + 1):
+            try:
+                self.client().write_points(points, time_precision='n')
+                return len(points)
+            except Exception:
+                if attempt == write_attempts:
+                    raise
+                logging.warning('Write of %i points failed: %s, retry (%i out of %i) in %i sec. ...', len(points), sys.exc_info()[1], attempt, write_attempts - 1, attempt)
+                time.sleep(attempt)
+
+    def submit(self, points):
+        return self.executor.submit(self.write, points)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+def import_file(path, file_format, location, writer, jobs, checkpoint):
+    skip = checkpoint.get(path, 0)
+    if skip:
+        logging.info('Resuming import of %s after %i records...', path, skip)
+    if file_format == "csv":
+        records = read_csv_records(path, skip, location)
+    else:
+        records = read_jsonl_records(path, skip, location)
+
+    #chunks in flight, at most 2 per job so memory use stays constant,
+    #checkpoint is moved only when all chunks before it are written
+    in_flight = deque()
+    points_written = 0
+    last_progress = time.monotonic()
+    started = last_progress
+
+    def complete_oldest():
+        consumed, future = in_flight.popleft()
+        written = future.result()
+        checkpoint[path] = skip + consumed
+        return written
+
+    for consumed, points in chunk_points(records, chunk_size):
+        in_flight.append((consumed, writer.submit(points)))
+        while len(in_flight) >= 2 * jobs or (in_flight and in_flight[0][1].done()):
+            points_written = points_written + complete_oldest()
+        if time.monotonic() - last_progress >= progress_interval:
+            last_progress = time.monotonic()
+            store_checkpoint(checkpoint_file, checkpoint)
+            logging.info('%s: %i records, %i points imported (%.0f points/sec)...', path, checkpoint.get(path, skip), points_written, points_written / (last_progress - started))
+    while in_flight:
+        points_written = points_written + complete_oldest()
+    store_checkpoint(checkpoint_file, checkpoint)
+    logging.info('%s: import completed, %i records, %i points imported in %.1f sec', path, checkpoint.get(path, skip), points_written, time.monotonic() - started)
+
+def main():
+    global chunk_size
+    global concurrency
+    global checkpoint_file
+
+    file_format = None
+    #not provided values are taken from settings of influxdbdatalogger
+    location = None
+    dbhost = None
+    dbport = None
+
+    try:
+        options, arguments = getopt.getopt(sys.argv[1:], 'f:c:j:k:l:h:p:', ['format=',
+                                                                        'chunk=',
+                                                                        'jobs=',
+                                                                        'checkpoint=',
+                                                                        'location=',
+                                                                        'host=',
+                                                                        'port=',
+                                                                        ])
+    except getopt.GetoptError as err:
+        print(str(err))
+        cmd_usage()
+
+    for opt, arg in options:
+        if opt in ('-f', '--format'):
+            file_format = arg
+        elif opt in ('-c', '--chunk'):
+            chunk_size = int(arg)
+        elif opt in ('-j', '--jobs'):
+            concurrency = int(arg)
+        elif opt in ('-k', '--checkpoint'):
+            checkpoint_file = arg
+        elif opt in ('-l', '--location'):
+            location = arg
+        elif opt in ('-h', '--host'):
+            dbhost = arg
+        elif opt in ('-p', '--port'):
+            dbport = int(arg)
+
+    if not arguments or file_format not in (None, "csv", "jsonl"):
+        cmd_usage()
+
+    logging.basicConfig(level = logging.INFO,format = '%(asctime)s:%(threadName)s:%(filename)s:%(lineno)s:%(levelname)s:%(message)s', handlers=[logging.StreamHandler(sys.stdout)])
+
+    try:
+        datalogger.CreateConfigLoader().load()
+    except (OSError, ValueError):
+        logging.error('Config: failed to load %s: %s', datalogger.config_file, sys.exc_info()[1])
+        exit(1)
+    if location is None:
+        location = datalogger.mqtt_topic.split("/")[0]
+    if dbhost is None:
+        dbhost = datalogger.influxdb_host
+    if dbport is None:
+        dbport = datalogger.influxdb_port
+
+    checkpoint = load_checkpoint(checkpoint_file)
+    writer = ChunkWriter(dbhost, dbport, datalogger.influxdb_user, datalogger.influxdb_pass, datalogger.influxdb_dbname, concurrency)
+    try:
+        for path in arguments:
+            if file_format is None:
+                #format is taken from file extension
+                path_format = "csv" if path.lower().endswith(".csv") else "jsonl"
+            else:
+                path_format = file_format
+            import_file(path, path_format, location, writer, concurrency, checkpoint)
+    except KeyboardInterrupt:
+        logging.info('Import interrupted, ctrl+C pressed, progress stored in %s', checkpoint_file)
+        store_checkpoint(checkpoint_file, checkpoint)
+        exit(1)
+    except Exception:
+        logging.error('Import stopped due to: %s, progress stored in %s', sys.exc_info()[1], checkpoint_file)
+        store_checkpoint(checkpoint_file, checkpoint)
+        exit(1)
+    finally:
+        writer.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,11 @@
 # Main tasks of the script are:                               #
 #     - read environment data received as mqtt message        #
 #     - store received data in InfluxDB database              #
+#     - evaluate alert rules on received samples and publish  #
+#       alert events as mqtt messages                         #
+#     - optionally run N worker processes, which share the    #
+#       topic with MQTT 5 shared subscription, so ingest      #
+#       scales with number of cores                           #
 #                          <C> Andrzej Mazur, 17/03/2021      #
 ###############################################################
 
@@ -15,14 +20,30 @@ import getopt
 import time
 import json
 import os
-from datetime import datetime
+import signal
+import socket
+import threading
+import multiprocessing
+import queue
 import paho.mqtt.client as mqtt
 from influxdb import InfluxDBClient
 
-#Set debug to True in order to log all messages!
+from profilinghooks import StageTimer, install_profiling_hooks
+from sdnotify import sd_notify, WatchdogNotifier
+from alertengine import AlertEngine, LoadAlertRules
+from logsetup import ConfigureLogging, SetLogLevel, debug_enabled
+from configloader import ConfigFile, ConfigLoader
+
+#Set debug to True in order to log all messages! Verbosity can be also
+#switched at runtime with SIGRTMIN (kill -RTMIN <pid>), see logsetup.py
 LOG_ALL = False
 #Set log_to_file flag to False in order to print logs on stdout
 LOG_TO_FILE = False
+#Length of sampling profiler window started with SIGUSR1 (kill -USR1 <pid>), in sec
+PROFILE_WINDOW = 30
+#Settings listed in CONFIG_SCHEMA can be changed in config file (see
+#configloader.py), which is loaded at start and reloaded at SIGHUP
+config_file = ConfigFile(__file__)
 
 ##########################
 #MQTT Connection Settings#
@@ -49,78 +70,91 @@ influxdb_dbname   = "climatedata"
 influxdb_measurementname = "climatemeasurements"
 influxdb_host = "127.0.0.1"
 influxdb_port = 8086
+#Received points are written to the database in batches of up to
+#influxdb_batch_size points, at least every influxdb_flush_interval sec
+influxdb_batch_size = 500
+influxdb_flush_interval = 1.0
+#Max number of points kept in memory while database is not available,
+#the oldest points are dropped when the limit is exceeded
+influxdb_max_buffered_points = 100000
+#Max time database writer waits for points without updating its heartbeat
+#and pinging systemd watchdog in sec, so long influxdb_flush_interval does
+#not get the service or worker restarted
+writer_wakeup_interval = 1.0
 
-def cmd_usage():
-  print ('Usage: '+sys.argv[0]+' {[-d | --debug debug] [-h | --host host] [-q | --qos QoS] [-t | --topic topic] [-a | --bfe280addr bfe280 address]')
-  exit (1)
+##################################
+#Worker Processes Settings       #
+##################################
+#Number of worker processes, with 1 single process subscribes to the topic
+#directly. With more workers every worker subscribes to the topic with MQTT 5
+#shared subscription ($share/<group>/<topic>) and broker load-balances
+#messages between them
+logger_workers = 1
+#Name of shared subscription group
+mqtt_share_group = "influxdbdatalogger"
+#Interval of worker statistics reports in sec
+stats_interval = 60
+#Min interval between restarts of crashed worker in sec
+worker_restart_delay = 5
+#Interval of worker heartbeat reports in sec, worker which database writer
+#did not make progress for worker_stall_timeout sec is killed and restarted
+worker_heartbeat_interval = 5
+worker_stall_timeout = 60
 
-try:
-    options, arguments = getopt.getopt(sys.argv[1:], 'dh:q:t:', ['debug', 
-                                                             'host=',
-                                                             'qos=',
-                                                             'topic=',   
-                                                             ])
-      
-except getopt.GetoptError as err:
-    print(str(err))
-    cmd_usage()
-    sys.exit(1)
-
-for opt, arg in options:
-    if opt in ('-d', '--debug'):
-        debug = True
-    elif opt in ('-h', '--host'):
-        mqtt_broker_address = arg
-    elif opt in ('-q', '--qos'):
-         mqtt_qos = int(arg)
-    elif opt in ('-t', '--topic'):
-         mqtt_topic = arg
-
-
-#configure logger module
-#levels: DEBUG,INFO,WARNING,ERROR,CRITICAL
- 
-#create two log file handlers, one for actual log file and another for stdout
-stdout_handler = logging.StreamHandler(sys.stdout)
-
-if LOG_TO_FILE == True:
-    #extract file name from filename.extension
-    idx=os.path.split(os.path.basename(__file__))[1].find('.')
-    file_name_wo_extension=os.path.split(os.path.basename(__file__))[1][:idx]
-    log_file = os.path.dirname(os.path.realpath(__file__)) + "/" + file_name_wo_extension + ".log"
-    file_handler = logging.FileHandler(filename=log_file)
-    hndls = [file_handler]
-    print ("Program logs are stored in: ", log_file)
-else:
-    hndls = [stdout_handler]
-        
-#configure logger module
-#levels: DEBUG,INFO,WARNING,ERROR,CRITICAL
+##########################
+#Alerting Settings       #
+##########################
+#Alert rules file (see alertengine.py), alerting is disabled if the file does not exist
+alert_rules_file = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "config", "alertrules.json")
+#Topic on which alert events are published
+mqtt_alert_topic = "47e0g1/headlesspi/alerts"
+#Interval of stale sensor checks in sec
+alert_check_interval = 1
 
-if LOG_ALL == True:
-    logging.basicConfig(level = logging.DEBUG,format = '%(asctime)s:%(threadName)s:%(filename)s:%(lineno)s:%(levelname)s:%(message)s', handlers=hndls)
-else:
-    logging.basicConfig(level = logging.INFO,format = '%(asctime)s:%(threadName)s:%(filename)s:%(lineno)s:%(levelname)s:%(message)s', handlers=hndls)
+#Settings which can be changed in config file and their types, settings
+#in RESTART_SETTINGS are applied only after restart of the program
+CONFIG_SCHEMA = {
+    "LOG_ALL": bool,
+    "mqtt_qos": int,
+    "mqtt_broker_address": str,
+    "mqtt_broker_port": int,
+    "mqtt_keep_alive": int,
+    "mqtt_topic": str,
+    "influxdb_user": str,
+    "influxdb_pass": str,
+    "influxdb_dbname": str,
+    "influxdb_measurementname": str,
+    "influxdb_host": str,
+    "influxdb_port": int,
+    "influxdb_batch_size": int,
+    "influxdb_flush_interval": float,
+    "influxdb_max_buffered_points": int,
+    "logger_workers": int,
+    "mqtt_share_group": str,
+    "mqtt_alert_topic": str,
+    "alert_check_interval": float,
+}
+RESTART_SETTINGS = ("logger_workers",)
 
-    
-if mqtt_qos != 0 and mqtt_qos != 1:
-    mqtt_qos = 1
-    logging.error('Provided MQTT QoS value is not supported. Default QoS=1 is used...')
+def cmd_usage():
+  print ('Usage: '+sys.argv[0]+' {[-d | --debug debug] [-h | --host host] [-q | --qos QoS] [-t | --topic topic] [-w | --workers number of worker processes]')
+  exit (1)
 
-def mqtt_on_connect(mqtt_client, userdata, flags, rc):
+#MQTT 5 callbacks get reason codes and properties, reason codes are logged with %s
+def mqtt_on_connect(mqtt_client, userdata, flags, rc, properties=None):
     if rc==0:
         mqtt.Client.connected_flag = True 
-        logging.info('Received:MQTT_CONNACK(rc=%i)',rc)
+        logging.info('Received:MQTT_CONNACK(rc=%s)',rc)
         logging.info('Connection to MQTT Broker established!')
         #Subscribing in on_connect() means that if we lose the connection and
         # reconnect then subscriptions will be renewed.
-        (result,mid)=mqtt_client.subscribe(mqtt_topic,mqtt_qos)
-        logging.info('Sent:MQTT_SUBSCRIBE(mid=%i, topic:%s, QoS=%i, rc=%i)',mid,mqtt_topic, mqtt_qos, result)
+        (result,mid)=mqtt_client.subscribe(mqtt_subscribe_topic,mqtt_qos)
+        logging.info('Sent:MQTT_SUBSCRIBE(mid=%i, topic:%s, QoS=%i, rc=%i)',mid,mqtt_subscribe_topic, mqtt_qos, result)
     else:
-        logging.info('Received:MQTT_CONNACK(rc=%i)',rc)
+        logging.info('Received:MQTT_CONNACK(rc=%s)',rc)
         logging.info('Connection establishment to MQTT Broker failed!')
         
-def mqtt_on_disconnect(mqtt_client, userdata, rc):
+def mqtt_on_disconnect(mqtt_client, userdata, rc, properties=None):
     mqtt.Client.connected_flag = False
     if rc==0:
        logging.info('Disconnection from MQTT Broker completed!')
@@ -128,117 +162,630 @@ def mqtt_on_disconnect(mqtt_client, userdata, rc):
         logging.error('Unexpected disconnection from MQTT Broker!')
         
 def mqtt_on_message(mqtt_client, userdata, msg):
-    logging.debug('Received:MQTT_PUBLISH(topic=%s, qos=%s, retain=%s, payload=%s)', msg.topic,msg.qos,msg.retain,msg.payload)
-    mqtt_msg = json.loads(msg.payload)
-    influxdb_store_data_sample(influxdb_host,influxdb_port,influxdb_user,influxdb_pass,influxdb_dbname,influxdb_measurementname, mqtt_msg)
+    debug = debug_enabled()
+    if debug:
+        logging.debug('Received:MQTT_PUBLISH(topic=%s, qos=%s, retain=%s, payload=%s)', msg.topic,msg.qos,msg.retain,msg.payload)
+    with stage_timer.stage("json_decode"):
+        mqtt_msg = json.loads(msg.payload)
+    with stage_timer.stage("influxdb_build_points"):
+        # format the measurements taken by bme280 and ds18b20 as influx points
+        dbrecord = influxdb_build_points(influxdb_measurementname, mqtt_topic.split("/")[0], mqtt_msg)
+
+    if debug:
+        #arguments of debug messages are evaluated only if they are logged
+        logging.debug('Measurements to be added to "%s" meas. in "%s" db:',influxdb_measurementname,influxdb_dbname)
+        for point in dbrecord:
+            logging.debug("   sensor id: %s, timestamp: %s, fields: %s", point['tags']['sensor_id'], point['time'], point['fields'])
 
+    if alert_engine is not None:
+        with stage_timer.stage("alerts"):
+            AlertsProcessPoints(dbrecord)
 
+    db_writer.add(dbrecord)
+
+def mqtt_on_alert_message(mqtt_client, userdata, msg):
+    #used by supervisor in worker mode, where every worker gets only part
+    #of the messages, so alerts are evaluated on separate subscription
+    try:
+        dbrecord = influxdb_build_points(influxdb_measurementname, mqtt_topic.split("/")[0], json.loads(msg.payload))
+    except (ValueError, KeyError, TypeError):
+        logging.error('Alerts: failed to decode measurement record: %s', sys.exc_info()[1])
+        return
+    AlertsProcessPoints(dbrecord)
     
-def mqtt_on_subscribe(client,userdata,mid,granted_qos):
-    logging.info('Received:MQTT_SUBACK(mid=%i,negotiatedQoS=%i)',mid, granted_qos[0])
+def mqtt_on_subscribe(client,userdata,mid,granted_qos,properties=None):
+    logging.info('Received:MQTT_SUBACK(mid=%i,negotiatedQoS=%s)',mid, granted_qos[0])
     logging.info('Client ready to receive messages!')
 
-def influxdb_store_data_sample(dbhost,dbport,dbuser,dbpass,dbname,dbmeasurement,data):
-    #build database records from received json string
-     
-    # connect to influx
-    # it is possible to connect once and in this function call just write to database, but it is less reliable method
-    ifclient = InfluxDBClient(dbhost,dbport,dbuser,dbpass,dbname)
-    
-    # write the measurement taken by bme280
-    # format the data as a single measurement for influx
-    
-    logging.debug('Measurement to be added to "%s" meas. in "%s" db:',dbmeasurement,dbname)
-    logging.debug("   sensor id: %s", str(data['bme280id']))
-    logging.debug('   timestamp: %s',list(data.keys())[1])
-    logging.debug('   temperature: %f%s',float(data[list(data.keys())[1]]['temperature']['value']),data[list(data.keys())[1]]['temperature']['unit'])
-    logging.debug('   pressure: %f%s',float(data[list(data.keys())[1]]['pressure']['value']),data[list(data.keys())[1]]['pressure']['unit'])
-    logging.debug('   humidity: %f%s',float(data[list(data.keys())[1]]['humidity']['value']),data[list(data.keys())[1]]['humidity']['unit'])
-
-    dbrecord = [
-        {
+def influxdb_build_points(dbmeasurement,location,data):
+    #build database records from received measurement record
+    points = []
+    if "bme280" in data or "ds18b2" in data or "bme280aux" in data:
+        #measurement record with integer epoch timestamps in ns,
+        #sample of not available sensor is not included in the record,
+        #samples of additional BME280 sensors are listed in bme280aux
+        if "bme280" in data:
+            sample = data['bme280']
+            points.append({
+                "measurement": dbmeasurement,
+                "tags": {
+                    "sensor_id":str(data['bme280id']),
+                    "location": location
+                    },
+                "time": int(sample['timestamp_ns']),
+                "fields": {
+                    "temperature_C": float(sample['temperature']['value']),
+                    "pressure_hPa": float(sample['pressure']['value']),
+                    "humidity_rH": float(sample['humidity']['value'])
+                }
+            })
+        for sample in data.get('bme280aux', ()):
+            points.append({
+                "measurement": dbmeasurement,
+                "tags": {
+                    "sensor_id":str(sample['id']),
+                    "location": location
+                    },
+                "time": int(sample['timestamp_ns']),
+                "fields": {
+                    "temperature_C": float(sample['temperature']['value']),
+                    "pressure_hPa": float(sample['pressure']['value']),
+                    "humidity_rH": float(sample['humidity']['value'])
+                }
+            })
+        if "ds18b2" in data:
+            sample = data['ds18b2']
+            points.append({
+                "measurement": dbmeasurement,
+                "tags": {
+                    "sensor_id":str(data['ds18b2id']),
+                    "location": location
+                    },
+                "time": int(sample['timestamp_ns']),
+                "fields": {
+                    "temperature_C": float(sample['temperature']['value'])
+                }
+            })
+    else:
+        #legacy measurement record, where RFC3339 timestamp strings are
+        #used as keys of bme280 and ds18b2 samples
+        keys = list(data.keys())
+        points.append({
             "measurement": dbmeasurement,
             "tags": {
                 "sensor_id":str(data['bme280id']),
-                "location": mqtt_topic.split("/")[0]
+                "location": location
                 },
-            "time": list(data.keys())[1],
+            "time": keys[1],
             "fields": {
-                "temperature_C": float(data[list(data.keys())[1]]['temperature']['value']),
-                "pressure_hPa": float(data[list(data.keys())[1]]['pressure']['value']),
-                "humidity_rH": float(data[list(data.keys())[1]]['humidity']['value'])
+                "temperature_C": float(data[keys[1]]['temperature']['value']),
+                "pressure_hPa": float(data[keys[1]]['pressure']['value']),
+                "humidity_rH": float(data[keys[1]]['humidity']['value'])
             }
-        }
-    ]
-
-    ifclient.write_points(dbrecord)
-    
-    # write the measurement taken by ds18b20
-    # format the data as a single measurement for influx
-
-    logging.debug('Measurement to be added to "%s" meas. in "%s" db:',dbmeasurement,dbname)
-    logging.debug("   sensor id: %s", str(data['ds18b2id']))
-    logging.debug('   timestamp: %s',list(data.keys())[3])
-    logging.debug('   temperature: %f%s',float(data[list(data.keys())[3]]['temperature']['value']),str(data[list(data.keys())[3]]['temperature']['unit']))
-
-    dbrecord = [
-        {
+        })
+        points.append({
             "measurement": dbmeasurement,
             "tags": {
                 "sensor_id":str(data['ds18b2id']),
-                "location": mqtt_topic.split("/")[0]
+                "location": location
                 },
-            "time": list(data.keys())[3],
+            "time": keys[3],
             "fields": {
-                "temperature_C": float(data[list(data.keys())[3]]['temperature']['value'])
+                "temperature_C": float(data[keys[3]]['temperature']['value'])
             }
-        }
-    ]
-    
-    ifclient.write_points(dbrecord)
+        })
+    return points
 
-    
-#create connection state flag in class
-mqtt.Client.connected_flag=False
+class InfluxDBBatchWriter(threading.Thread):
+    #Collects points of received measurement records and writes them to
+    #the database in batches from its own thread, so database latency
+    #never blocks mqtt network loop. Database connection is reused and
+    #created again after failed write, points of failed write are kept
+    #and written with the next batch. Writer updates heartbeat and pings
+    #systemd watchdog at least every writer_wakeup_interval while it
+    #waits, so only hung database write gets the service restarted.
+
+    def __init__(self, dbhost, dbport, dbuser, dbpass, dbname, batch_size, flush_interval, max_buffered_points, watchdog=None):
+        threading.Thread.__init__(self, name="InfluxDBWriter", daemon=True)
+        self.dbparams = (dbhost, dbport, dbuser, dbpass, dbname)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered_points = max_buffered_points
+        self.condition = threading.Condition()
+        self.points = []
+        self.stop_requested = False
+        self.ifclient = None
+        self.ifclient_params = None
+        self.watchdog = watchdog
+        self.heartbeat = time.monotonic()
+        self.stats = {"messages": 0, "points_written": 0, "points_dropped": 0, "write_errors": 0}
+
+    def add(self, points):
+        with self.condition:
+            self.points.extend(points)
+            self.stats["messages"] += 1
+            self.drop_overflow()
+            if len(self.points) >= self.batch_size:
+                self.condition.notify()
+
+    def drop_overflow(self):
+        overflow = len(self.points) - self.max_buffered_points
+        if overflow > 0:
+            del self.points[:overflow]
+            self.stats["points_dropped"] += overflow
+
+    def set_params(self, dbhost, dbport, dbuser, dbpass, dbname, batch_size, flush_interval, max_buffered_points):
+        #database connection is created again with the next write, buffered points are kept
+        with self.condition:
+            self.dbparams = (dbhost, dbport, dbuser, dbpass, dbname)
+            self.batch_size = batch_size
+            self.flush_interval = flush_interval
+            self.max_buffered_points = max_buffered_points
+            self.drop_overflow()
+            self.condition.notify()
 
-#create mqtt client instance
-mqtt_client = mqtt.Client()
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats["points_buffered"] = len(self.points)
+        return stats
 
-#bind callback functions 
-mqtt_client.on_connect=mqtt_on_connect
-mqtt_client.on_disconnect=mqtt_on_disconnect
-mqtt_client.on_message=mqtt_on_message
-mqtt_client.on_subscribe=mqtt_on_subscribe
+    def alive(self):
+        self.heartbeat = time.monotonic()
+        if self.watchdog is not None:
+            self.watchdog.ping(self.heartbeat)
 
-#connect to MQTT Broker
+    def wait(self, deadline, for_batch):
+        #called with condition locked, waits until deadline, stop request or
+        #full batch (for_batch), in slices of writer_wakeup_interval
+        while self.stop_requested == False and (for_batch == False or len(self.points) < self.batch_size):
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            self.condition.wait(min(timeout, writer_wakeup_interval))
+            self.alive()
 
-mqtt_client_connect_retry_limit = 30
-mqtt_client_connect_retry = 0
-mqtt_client_connect_success = False
+    def run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            self.alive()
+            with self.condition:
+                self.wait(next_flush, True)
+                batch = self.points
+                self.points = []
+                stopping = self.stop_requested
+            next_flush = time.monotonic() + self.flush_interval
+            if batch and self.write(batch) == False and stopping == False:
+                #database not available, wait for next flush before retrying
+                with self.condition:
+                    self.wait(next_flush, False)
+            if stopping:
+                break
 
-while (mqtt_client_connect_retry < mqtt_client_connect_retry_limit and mqtt_client_connect_success == False):
+    def write(self, batch):
+        try:
+            if self.ifclient is None or self.ifclient_params != self.dbparams:
+                if self.ifclient is not None:
+                    logging.info('InfluxDB settings changed, reconnecting...')
+                    self.ifclient.close()
+                self.ifclient_params = self.dbparams
+                self.ifclient = InfluxDBClient(*self.ifclient_params)
+            # integer timestamps are passed to the database as they are, without any conversion
+            with stage_timer.stage("influxdb_write"):
+                self.ifclient.write_points(batch, time_precision='n')
+            with self.condition:
+                self.stats["points_written"] += len(batch)
+            return True
+        except Exception:
+            logging.error('Failed to write %i points to InfluxDB: %s', len(batch), sys.exc_info()[1])
+            self.ifclient = None
+            with self.condition:
+                self.stats["write_errors"] += 1
+                self.points[:0] = batch
+                self.drop_overflow()
+            return False
+
+    def stop(self):
+        #writes buffered points and stops the thread
+        with self.condition:
+            self.stop_requested = True
+            self.condition.notify()
+        self.join()
+
+def StartAlertEngine():
+    global alert_engine
+    if not os.path.exists(alert_rules_file):
+        logging.info('Alerts: rules file %s not available, alerting disabled', alert_rules_file)
+        return
     try:
-        if mqtt_client_connect_retry != 0: # there shall be no delay between loopstart() and connect messages!
-            time.sleep(1+mqtt_client_connect_retry)
-        logging.info('Sent:MQTT_CONNECT:(IP:%s,TCP Port:%s,Topic:%s,QoS:%i,KeepAlive:%i)',mqtt_broker_address, mqtt_broker_port, mqtt_topic, mqtt_qos, mqtt_keep_alive)
-        #connect is a blocking function
-        mqtt_client.connect(mqtt_broker_address,mqtt_broker_port,mqtt_keep_alive)
-        mqtt_client_connect_success = True
-    except KeyboardInterrupt:
-        logging.info('Exiting the program, ctrl+C pressed...')
+        rules = LoadAlertRules(alert_rules_file)
+    except (OSError, ValueError):
+        logging.error('Alerts: failed to load rules from %s: %s, alerting disabled', alert_rules_file, sys.exc_info()[1])
+        return
+    alert_engine = AlertEngine(rules, mqtt_publish_alert)
+    Thread = threading.Thread(target = AlertCheckThread, name = "AlertCheckThread", daemon = True)
+    Thread.start()
+    logging.info('Alerts: %i rules loaded from %s, events are published on topic: %s', len(rules), alert_rules_file, mqtt_alert_topic)
+
+def AlertCheckThread():
+    while (True):
+        time.sleep(alert_check_interval)
+        alert_engine.check_stale()
+
+def AlertsProcessPoints(dbrecord):
+    for point in dbrecord:
+        #legacy records have RFC3339 timestamps, receive time is used for them
+        timestamp = point['time'] if isinstance(point['time'], int) else time.time_ns()
+        alert_engine.process_fields(point['tags']['sensor_id'], timestamp, point['fields'])
+
+def mqtt_publish_alert(event):
+    if alert_mqtt_client is None or mqtt.Client.connected_flag == False:
+        logging.error('Alerts: not connected to MQTT Broker, event of rule %s not published', event["rule"])
+        return
+    alert_mqtt_client.publish(mqtt_alert_topic, json.dumps(event), mqtt_qos)
+
+def StartAlertClient():
+    #separate non-shared subscription of supervisor, which feeds alert engine in worker mode
+    global alert_mqtt_client
+    alert_mqtt_client = mqtt.Client("influxdbdatalogger-" + socket.gethostname() + "-alerts")
+    alert_mqtt_client.on_connect=mqtt_on_connect
+    alert_mqtt_client.on_disconnect=mqtt_on_disconnect
+    alert_mqtt_client.on_message=mqtt_on_alert_message
+    alert_mqtt_client.on_subscribe=mqtt_on_subscribe
+    logging.info('Sent:MQTT_CONNECT:(IP:%s,TCP Port:%s,Topic:%s,QoS:%i,KeepAlive:%i)',mqtt_broker_address, mqtt_broker_port, mqtt_subscribe_topic, mqtt_qos, mqtt_keep_alive)
+    alert_mqtt_client.connect_async(mqtt_broker_address,mqtt_broker_port,mqtt_keep_alive)
+    alert_mqtt_client.loop_start()
+
+#per-stage timing of message handling, reported by SIGUSR1 profiler
+stage_timer = StageTimer()
+
+#topic subscribed by mqtt client, with worker processes it is shared subscription of mqtt_topic
+mqtt_subscribe_topic = mqtt_topic
+shared_subscription = False
+
+#mqtt client receiving measurement records, mqtt_reconnect_requested makes
+#mqtt_run_client connect again after disconnect at config reload
+mqtt_client = None
+mqtt_reconnect_requested = False
+
+#ConfigLoader of the process, reload_requested is set by SIGHUP handler
+config_loader = None
+reload_requested = False
+
+#InfluxDBBatchWriter of the process
+db_writer = None
+
+#AlertEngine of the process and mqtt client publishing its events, None if alerting is disabled
+alert_engine = None
+alert_mqtt_client = None
+
+def SubscriptionTopic():
+    if shared_subscription == True:
+        return "$share/" + mqtt_share_group + "/" + mqtt_topic
+    return mqtt_topic
+
+def CreateConfigLoader():
+    #also used by influxdbbulkimport and influxdbexport, so they use the
+    #database of deployed config file
+    return ConfigLoader(config_file, CONFIG_SCHEMA, globals(), ValidateConfig)
+
+def ValidateConfig(config):
+    if config["mqtt_qos"] not in (0, 1):
+        raise ValueError("mqtt_qos must be 0 or 1")
+    if not 0 < config["mqtt_broker_port"] < 65536 or not 0 < config["influxdb_port"] < 65536:
+        raise ValueError("port out of range")
+    if config["influxdb_batch_size"] < 1 or config["influxdb_max_buffered_points"] < 1 or config["logger_workers"] < 1:
+        raise ValueError("influxdb_batch_size, influxdb_max_buffered_points and logger_workers must be positive")
+    if config["influxdb_flush_interval"] <= 0 or config["alert_check_interval"] <= 0:
+        raise ValueError("influxdb_flush_interval and alert_check_interval must be positive")
+
+def handleSIGHUP(signum, frame):
+    #config is reloaded by ConfigReloadThread or by supervisor loop
+    global reload_requested
+    reload_requested = True
+
+def ReloadConfig():
+    #applies changed settings in place, buffered points are kept and mqtt
+    #client is reconnected or resubscribed only when its settings change
+    global mqtt_subscribe_topic
+    global mqtt_reconnect_requested
+    try:
+        changed = set(config_loader.load())
+    except (OSError, ValueError):
+        logging.error('Config: failed to load %s: %s, current settings are kept', config_file, sys.exc_info()[1])
+        return
+    if "LOG_ALL" in changed:
+        SetLogLevel(LOG_ALL)
+    for name in RESTART_SETTINGS:
+        if name in changed:
+            logging.warning('Config: %s changed, restart required to apply it', name)
+    if db_writer is not None and changed & {"influxdb_host", "influxdb_port", "influxdb_user", "influxdb_pass", "influxdb_dbname", "influxdb_batch_size", "influxdb_flush_interval", "influxdb_max_buffered_points"}:
+        db_writer.set_params(influxdb_host,influxdb_port,influxdb_user,influxdb_pass,influxdb_dbname,influxdb_batch_size,influxdb_flush_interval,influxdb_max_buffered_points)
+
+    old_topic = mqtt_subscribe_topic
+    mqtt_subscribe_topic = SubscriptionTopic()
+    #supervisor in worker mode has only alert client
+    client = mqtt_client if mqtt_client is not None else alert_mqtt_client
+    if client is None:
+        return
+    if changed & {"mqtt_broker_address", "mqtt_broker_port", "mqtt_keep_alive"}:
+        logging.info('MQTT Broker settings changed, reconnecting...')
+        if client is mqtt_client:
+            #network loop of mqtt_run_client returns and connects again
+            mqtt_reconnect_requested = True
+            client.disconnect()
+        else:
+            client.disconnect()
+            client.loop_stop()
+            logging.info('Sent:MQTT_CONNECT:(IP:%s,TCP Port:%s,Topic:%s,QoS:%i,KeepAlive:%i)',mqtt_broker_address, mqtt_broker_port, mqtt_subscribe_topic, mqtt_qos, mqtt_keep_alive)
+            client.connect_async(mqtt_broker_address,mqtt_broker_port,mqtt_keep_alive)
+            client.loop_start()
+    elif (mqtt_subscribe_topic != old_topic or "mqtt_qos" in changed) and mqtt.Client.connected_flag == True:
+        #new topic is subscribed also by on_connect after reconnection
+        (result,mid)=client.unsubscribe(old_topic)
+        logging.info('Sent:MQTT_UNSUBSCRIBE(mid=%i, topic:%s, rc=%i)',mid,old_topic, result)
+        (result,mid)=client.subscribe(mqtt_subscribe_topic,mqtt_qos)
+        logging.info('Sent:MQTT_SUBSCRIBE(mid=%i, topic:%s, QoS=%i, rc=%i)',mid,mqtt_subscribe_topic, mqtt_qos, result)
+
+def ConfigReloadThread():
+    global reload_requested
+    while (True):
+        time.sleep(1)
+        if reload_requested == True:
+            reload_requested = False
+            sd_notify("RELOADING=1")
+            ReloadConfig()
+            sd_notify("READY=1")
+
+def StartConfigReloadThread():
+    Thread = threading.Thread(target = ConfigReloadThread, name = "ConfigReloadThread", daemon = True)
+    Thread.start()
+
+def StartDBWriter(watchdog=None):
+    global db_writer
+    db_writer = InfluxDBBatchWriter(influxdb_host,influxdb_port,influxdb_user,influxdb_pass,influxdb_dbname,influxdb_batch_size,influxdb_flush_interval,influxdb_max_buffered_points,watchdog)
+    db_writer.start()
+
+def mqtt_run_client(client_id="", protocol=mqtt.MQTTv311):
+    global alert_mqtt_client
+    global mqtt_client
+    global mqtt_reconnect_requested
+    #create connection state flag in class
+    mqtt.Client.connected_flag=False
+
+    #create mqtt client instance
+    mqtt_client = mqtt.Client(client_id, protocol=protocol)
+    alert_mqtt_client = mqtt_client
+
+    #bind callback functions 
+    mqtt_client.on_connect=mqtt_on_connect
+    mqtt_client.on_disconnect=mqtt_on_disconnect
+    mqtt_client.on_message=mqtt_on_message
+    mqtt_client.on_subscribe=mqtt_on_subscribe
+
+    #connect to MQTT Broker, again after disconnect requested by config reload
+    while (True):
+        mqtt_client_connect_retry_limit = 30
+        mqtt_client_connect_retry = 0
+        mqtt_client_connect_success = False
+
+        while (mqtt_client_connect_retry < mqtt_client_connect_retry_limit and mqtt_client_connect_success == False):
+            try:
+                if mqtt_client_connect_retry != 0: # there shall be no delay between loopstart() and connect messages!
+                    time.sleep(1+mqtt_client_connect_retry)
+                logging.info('Sent:MQTT_CONNECT:(IP:%s,TCP Port:%s,Topic:%s,QoS:%i,KeepAlive:%i)',mqtt_broker_address, mqtt_broker_port, mqtt_subscribe_topic, mqtt_qos, mqtt_keep_alive)
+                #connect is a blocking function
+                mqtt_client.connect(mqtt_broker_address,mqtt_broker_port,mqtt_keep_alive)
+                mqtt_client_connect_success = True
+            except KeyboardInterrupt:
+                logging.info('Exiting the program, ctrl+C pressed...')
+                return
+            except Exception:
+                mqtt_client_connect_retry = mqtt_client_connect_retry + 1
+                logging.error('Connection establishment failed due to: %s, retry (%i out of % i) in %i sec. ...', sys.exc_info()[1],mqtt_client_connect_retry, mqtt_client_connect_retry_limit, 1+mqtt_client_connect_retry)
+                pass
+
+        #start infinite network loop, disconnect from MQTT Broker at keyboard interupt
+        try:
+            mqtt_client.loop_forever()
+        except KeyboardInterrupt:
+            logging.info('Exiting the program, ctrl+C pressed...')
+            logging.info('Sent:MQTT_DISCONNECT')
+            logging.info('Disconnecting from MQTT Broker')
+            mqtt_client.disconnect();
+            return
+        if mqtt_reconnect_requested == False:
+            break
+        mqtt_reconnect_requested = False
+
+def handleSIGTERM(signum, frame):
+    logging.info('Exiting the program, SIGTERM received...')
+    sys.exit(0)
+
+def StatsReportingThread(worker_no, stats_queue):
+    #monotonic clock is system wide, so heartbeat is compared with
+    #the time of supervisor process
+    while (True):
+        time.sleep(worker_heartbeat_interval)
+        stats_queue.put((worker_no, os.getpid(), db_writer.get_stats(), db_writer.heartbeat))
+
+def logger_worker_main(worker_no, stats_queue):
+    global mqtt_subscribe_topic
+    global shared_subscription
+    global alert_engine
+    #alerts are evaluated by supervisor, which gets all the messages
+    alert_engine = None
+    #every worker has its own mqtt connection and database writer, broker
+    #delivers every message of shared subscription to one of the workers
+    signal.signal(signal.SIGTERM, handleSIGTERM)
+    #only supervisor talks to systemd, it watches workers with heartbeats
+    for name in ("NOTIFY_SOCKET", "WATCHDOG_USEC", "WATCHDOG_PID"):
+        os.environ.pop(name, None)
+    shared_subscription = True
+    mqtt_subscribe_topic = SubscriptionTopic()
+    StartDBWriter()
+    #SIGHUP is forwarded to workers by supervisor
+    StartConfigReloadThread()
+    Thread = threading.Thread(target = StatsReportingThread, name = "StatsThread", args = (worker_no, stats_queue, ), daemon = True)
+    Thread.start()
+    try:
+        mqtt_run_client("influxdbdatalogger-" + socket.gethostname() + "-" + str(worker_no), mqtt.MQTTv5)
+    finally:
+        db_writer.stop()
+
+def logger_supervisor(workers):
+    global reload_requested
+    #starts worker processes, restarts crashed and stalled ones and logs their aggregated statistics
+    stats_queue = multiprocessing.Queue()
+    processes = {}
+    started = {}
+    worker_stats = {}
+    heartbeats = {}
+
+    def start_worker(worker_no):
+        process = multiprocessing.Process(target = logger_worker_main, name = "LoggerWorker-" + str(worker_no), args = (worker_no, stats_queue, ))
+        process.start()
+        processes[worker_no] = process
+        started[worker_no] = time.monotonic()
+        heartbeats[worker_no] = started[worker_no]
+        logging.info('Worker %i started (pid %i)', worker_no, process.pid)
+
+    signal.signal(signal.SIGTERM, handleSIGTERM)
+    for worker_no in range(workers):
+        start_worker(worker_no)
+    StartAlertEngine()
+    if alert_engine is not None:
+        StartAlertClient()
+    watchdog = WatchdogNotifier()
+    sd_notify("READY=1")
+
+    last_report = time.monotonic()
+    last_messages = 0
+    try:
+        while (True):
+            watchdog.ping()
+            if reload_requested == True:
+                reload_requested = False
+                sd_notify("RELOADING=1")
+                ReloadConfig()
+                #every worker reloads the config file itself
+                for process in processes.values():
+                    if process.is_alive():
+                        os.kill(process.pid, signal.SIGHUP)
+                sd_notify("READY=1")
+            try:
+                worker_no, pid, stats, heartbeat = stats_queue.get(timeout=1)
+                #stats of the worker process currently running are kept only
+                if processes[worker_no].pid == pid:
+                    worker_stats[worker_no] = stats
+                    heartbeats[worker_no] = heartbeat
+            except queue.Empty:
+                pass
+
+            for worker_no, process in list(processes.items()):
+                if process.is_alive() and time.monotonic() - heartbeats[worker_no] >= worker_stall_timeout:
+                    logging.error('Worker %i (pid %i) stalled for %i sec, killing it...', worker_no, process.pid, time.monotonic() - heartbeats[worker_no])
+                    process.kill()
+                    process.join()
+                if not process.is_alive() and time.monotonic() - started[worker_no] >= worker_restart_delay:
+                    logging.error('Worker %i (pid %i) exited with code %s, restarting...', worker_no, process.pid, process.exitcode)
+                    worker_stats.pop(worker_no, None)
+                    start_worker(worker_no)
+
+            if time.monotonic() - last_report >= stats_interval:
+                totals = {}
+                for stats in worker_stats.values():
+                    for key, value in stats.items():
+                        totals[key] = totals.get(key, 0) + value
+                messages = totals.get("messages", 0)
+                logging.info('Workers: %i running, %.1f msg/s, totals: %s', sum(1 for process in processes.values() if process.is_alive()), max(messages - last_messages, 0) / (time.monotonic() - last_report), totals)
+                last_messages = messages
+                last_report = time.monotonic()
+    except (KeyboardInterrupt, SystemExit):
+        if alert_mqtt_client is not None:
+            alert_mqtt_client.loop_stop()
+            alert_mqtt_client.disconnect()
+        logging.info('Stopping worker processes...')
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+
+def main():
+    global mqtt_qos
+    global mqtt_subscribe_topic
+    global config_loader
+
+    qos_supported = mqtt_qos == 0 or mqtt_qos == 1
+    if qos_supported == False:
+        mqtt_qos = 1
+    #command line options override settings of config file
+    config_loader = CreateConfigLoader()
+
+    try:
+        options, arguments = getopt.getopt(sys.argv[1:], 'dh:q:t:w:', ['debug', 
+                                                                   'host=',
+                                                                   'qos=',
+                                                                   'topic=',
+                                                                   'workers=',
+                                                                   ])
+      
+    except getopt.GetoptError as err:
+        print(str(err))
+        cmd_usage()
+        sys.exit(1)
+
+    for opt, arg in options:
+        if opt in ('-d', '--debug'):
+            config_loader.override("LOG_ALL", True)
+        elif opt in ('-h', '--host'):
+            config_loader.override("mqtt_broker_address", arg)
+        elif opt in ('-q', '--qos'):
+            if int(arg) == 0 or int(arg) == 1:
+                config_loader.override("mqtt_qos", int(arg))
+            else:
+                qos_supported = False
+        elif opt in ('-t', '--topic'):
+            config_loader.override("mqtt_topic", arg)
+        elif opt in ('-w', '--workers'):
+            config_loader.override("logger_workers", int(arg))
+
+    ConfigureLogging(__file__, LOG_ALL, LOG_TO_FILE)
+
+    if qos_supported == False:
+        logging.error('Provided MQTT QoS value is not supported. Default QoS=1 is used...')
+
+    try:
+        if "LOG_ALL" in config_loader.load():
+            SetLogLevel(LOG_ALL)
+    except (OSError, ValueError):
+        logging.error('Config: failed to load %s: %s, default settings are used', config_file, sys.exc_info()[1])
+
+    mqtt_subscribe_topic = mqtt_topic
+
+    #reload config file at SIGHUP, i.e.: systemctl reload dataloggerinfluxdb
+    signal.signal(signal.SIGHUP, handleSIGHUP)
+
+    #SIGUSR1 - profile the program for PROFILE_WINDOW sec., SIGUSR2 - dump thread stacks and allocations
+    #reports are stored in working directory of the process
+    install_profiling_hooks("influxdbdatalogger", stage_timer, PROFILE_WINDOW)
+
+    if logger_workers > 1:
+        logger_supervisor(logger_workers)
         exit(0)
-    except:
-        mqtt_client_connect_retry = mqtt_client_connect_retry + 1
-        logging.error('Connection establishment failed due to: %s, retry (%i out of % i) in %i sec. ...', sys.exc_info()[1],mqtt_client_connect_retry, mqtt_client_connect_retry_limit, 1+mqtt_client_connect_retry)
-        pass
-
-#start infinite network loop, disconnect from MQTT Broker at keyboard interupt
-try:
-    mqtt_client.loop_forever()
-except KeyboardInterrupt:
-    logging.info('Exiting the program, ctrl+C pressed...')
-    logging.info('Sent:MQTT_DISCONNECT')
-    logging.info('Disconnecting from MQTT Broker')
-    mqtt_client.disconnect();
+
+    #SystemExit raised by the handler unwinds through db_writer.stop(),
+    #so buffered points are written before exit
+    signal.signal(signal.SIGTERM, handleSIGTERM)
+    StartAlertEngine()
+    StartDBWriter(WatchdogNotifier())
+    StartConfigReloadThread()
+    sd_notify("READY=1")
+    try:
+        mqtt_run_client()
+    finally:
+        db_writer.stop()
     exit (0)
 
+if __name__ == "__main__":
+    main()
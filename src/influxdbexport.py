@@ -0,0 +1,208 @@
+#!/usr/bin/python3
+
+###############################################################
+# influxdbexport.py script exports measurements stored by     #
+# influxdbdatalogger for offline analysis. Main features:     #
+#     - every sensor is exported to its own csv or parquet    #
+#       file, sensors are exported in parallel                #
+#     - time range is paged through with queries for fixed    #
+#       time windows, results are streamed in chunks and      #
+#       written to the file right away, so memory use does    #
+#       not depend on amount of exported data                 #
+# csv files have the same columns as input of                 #
+# influxdbbulkimport.py (time as epoch in ns), i.e.:          #
+#     influxdbexport.py -s 2021-03-17T00:00:00Z -f parquet    #
+###############################################################
+
+import logging
+import sys
+import getopt
+import time
+import csv
+import os
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from influxdb import InfluxDBClient
+from influxdb.resultset import ResultSet
+
+import influxdbdatalogger as datalogger
+
+#Length of time window queried with single request, in hours
+page_hours = 24
+#Number of points returned by the database in single chunk of response
+query_chunk_size = 10000
+#Number of sensors exported in parallel
+concurrency = 4
+#Default length of exported time range, when start is not given, in days
+default_range_days = 30
+
+COLUMNS = ("time", "sensor_id", "location", "temperature_C", "pressure_hPa", "humidity_rH")
+
+def cmd_usage():
+    print ('Usage: '+sys.argv[0]+' {[-s | --start start time] [-e | --end end time] [-i | --sensors sensor ids] [-f | --format csv|parquet] [-o | --output output directory] [-j | --jobs concurrency] [-w | --window page hours] [-h | --host influxdb host] [-p | --port influxdb port]}')
+    print ('Start and end time are given as RFC3339 strings or epoch in ns, comma separated sensor ids default to all sensors')
+    exit (1)
+
+def parse_time_ns(value):
+    if value.isdigit():
+        return int(value)
+    timestampobj = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if timestampobj.tzinfo is None:
+        timestampobj = timestampobj.replace(tzinfo=timezone.utc)
+    return int(timestampobj.timestamp()) * 1000000000 + timestampobj.microsecond * 1000
+
+def list_sensors(ifclient, dbmeasurement):
+    result = ifclient.query('SHOW TAG VALUES FROM "%s" WITH KEY = "sensor_id"' % dbmeasurement)
+    return [row['value'] for row in result.get_points()]
+
+def query_rows(ifclient, dbmeasurement, sensor_id, start, end):
+    #pages through [start, end) time range, yields rows as tuples of COLUMNS
+    page = page_hours * 3600 * 1000000000
+    query = ('SELECT "temperature_C", "pressure_hPa", "humidity_rH", "location" FROM "%s" '
+             'WHERE "sensor_id" = $sensor_id AND time >= $start AND time < $end' % dbmeasurement)
+    page_start = start
+    while page_start < end:
+        page_end = min(page_start + page, end)
+        result = ifclient.query(query, bind_params={"sensor_id": sensor_id, "start": page_start, "end": page_end},
+                                epoch='ns', chunked=True, chunk_size=query_chunk_size)
+        #older database clients return chunked response as single result set
+        chunks = [result] if isinstance(result, ResultSet) else result
+        for chunk in chunks:
+            for point in chunk.get_points():
+                yield (point['time'], sensor_id, point.get('location'), point.get('temperature_C'), point.get('pressure_hPa'), point.get('humidity_rH'))
+        page_start = page_end
+
+def write_csv(path, rows):
+    count = 0
+    with open(path, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count = count + 1
+    return count
+
+def write_parquet(path, rows):
+    #pyarrow is needed only for parquet export
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = pyarrow.schema([
+        ("time", pyarrow.timestamp("ns", tz="UTC")),
+        ("sensor_id", pyarrow.string()),
+        ("location", pyarrow.string()),
+        ("temperature_C", pyarrow.float64()),
+        ("pressure_hPa", pyarrow.float64()),
+        ("humidity_rH", pyarrow.float64()),
+    ])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= query_chunk_size:
+                count = count + write_parquet_batch(writer, schema, batch)
+                batch = []
+        if batch:
+            count = count + write_parquet_batch(writer, schema, batch)
+    return count
+
+def write_parquet_batch(writer, schema, batch):
+    import pyarrow
+    columns = [pyarrow.array([row[i] for row in batch], type=schema.field(i).type) for i in range(len(COLUMNS))]
+    writer.write_table(pyarrow.Table.from_arrays(columns, schema=schema))
+    return len(batch)
+
+def export_sensor(dbparams, dbmeasurement, sensor_id, start, end, file_format, output_dir):
+    started = time.monotonic()
+    ifclient = InfluxDBClient(*dbparams)
+    path = os.path.join(output_dir, dbmeasurement + "_" + sensor_id + "." + file_format)
+    rows = query_rows(ifclient, dbmeasurement, sensor_id, start, end)
+    if file_format == "parquet":
+        count = write_parquet(path, rows)
+    else:
+        count = write_csv(path, rows)
+    logging.info('Sensor %s: %i rows exported to %s in %.1f sec', sensor_id, count, path, time.monotonic() - started)
+    return count
+
+def main():
+    global page_hours
+    global concurrency
+
+    end = time.time_ns()
+    start = None
+    sensors = None
+    file_format = "csv"
+    output_dir = "."
+    #not provided values are taken from settings of influxdbdatalogger
+    dbhost = None
+    dbport = None
+
+    try:
+        options, arguments = getopt.getopt(sys.argv[1:], 's:e:i:f:o:j:w:h:p:', ['start=',
+                                                                            'end=',
+                                                                            'sensors=',
+                                                                            'format=',
+                                                                            'output=',
+                                                                            'jobs=',
+                                                                            'window=',
+                                                                            'host=',
+                                                                            'port=',
+                                                                            ])
+        for opt, arg in options:
+            if opt in ('-s', '--start'):
+                start = parse_time_ns(arg)
+            elif opt in ('-e', '--end'):
+                end = parse_time_ns(arg)
+            elif opt in ('-i', '--sensors'):
+                sensors = arg.split(",")
+            elif opt in ('-f', '--format'):
+                file_format = arg
+            elif opt in ('-o', '--output'):
+                output_dir = arg
+            elif opt in ('-j', '--jobs'):
+                concurrency = int(arg)
+            elif opt in ('-w', '--window'):
+                page_hours = int(arg)
+            elif opt in ('-h', '--host'):
+                dbhost = arg
+            elif opt in ('-p', '--port'):
+                dbport = int(arg)
+    except (getopt.GetoptError, ValueError) as err:
+        print(str(err))
+        cmd_usage()
+
+    if file_format not in ("csv", "parquet"):
+        cmd_usage()
+    if start is None:
+        start = end - default_range_days * 24 * 3600 * 1000000000
+
+    logging.basicConfig(level = logging.INFO,format = '%(asctime)s:%(threadName)s:%(filename)s:%(lineno)s:%(levelname)s:%(message)s', handlers=[logging.StreamHandler(sys.stdout)])
+
+    try:
+        datalogger.CreateConfigLoader().load()
+    except (OSError, ValueError):
+        logging.error('Config: failed to load %s: %s', datalogger.config_file, sys.exc_info()[1])
+        exit(1)
+    if dbhost is None:
+        dbhost = datalogger.influxdb_host
+    if dbport is None:
+        dbport = datalogger.influxdb_port
+
+    dbparams = (dbhost, dbport, datalogger.influxdb_user, datalogger.influxdb_pass, datalogger.influxdb_dbname)
+    dbmeasurement = datalogger.influxdb_measurementname
+    if sensors is None:
+        sensors = list_sensors(InfluxDBClient(*dbparams), dbmeasurement)
+    logging.info('Exporting %i sensors: %s', len(sensors), ", ".join(sensors))
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="Export") as executor:
+            futures = [executor.submit(export_sensor, dbparams, dbmeasurement, sensor_id, start, end, file_format, output_dir) for sensor_id in sensors]
+            total = sum(future.result() for future in futures)
+    except Exception:
+        logging.error('Export failed due to: %s', sys.exc_info()[1])
+        exit(1)
+    logging.info('Export completed, %i rows exported', total)
+
+if __name__ == "__main__":
+    main()
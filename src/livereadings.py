@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+
+###############################################################
+# livereadings.py module serves the latest measurement record #
+# of digitalthermometer to LAN clients directly from memory,  #
+# without going through MQTT broker or InfluxDB:              #
+#     - GET /readings - latest record as JSON document        #
+#     - GET /stream   - Server-Sent Events stream, every new  #
+#                       record is pushed as single event      #
+# Server runs in its own daemon threads (one per client), the #
+# measurement loop only hands over already serialized record, #
+# i.e.:                                                       #
+#     curl http://<pi>:8080/readings                          #
+#     curl -N http://<pi>:8080/stream                         #
+###############################################################
+
+import threading
+import logging
+import sys
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+#Interval of SSE keep-alive comments sent while there is no new record, in sec
+SSE_KEEPALIVE_INTERVAL = 15
+
+
+class LiveReadings:
+    #Latest measurement record shared between measurement loop and
+    #client threads. Record is kept as serialized JSON bytes, so it is
+    #encoded once per cycle regardless of number of clients.
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.record = None
+        self.seq = 0
+
+    def publish(self, record):
+        with self.condition:
+            self.record = record
+            self.seq = self.seq + 1
+            self.condition.notify_all()
+
+    def latest(self):
+        with self.condition:
+            return self.seq, self.record
+
+    def wait_newer(self, seq, timeout):
+        #returns (seq, record) of the record newer than seq or
+        #(seq, None) when no new record arrived within timeout
+        with self.condition:
+            if self.seq == seq:
+                self.condition.wait(timeout)
+            if self.seq == seq:
+                return seq, None
+            return self.seq, self.record
+
+
+class LiveReadingsHandler(BaseHTTPRequestHandler):
+
+    server_version = "digitalthermometer"
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/readings":
+            self.send_readings()
+        elif path == "/stream":
+            self.send_stream()
+        else:
+            self.send_error(404)
+
+    def send_readings(self):
+        seq, record = self.server.readings.latest()
+        if record is None:
+            self.send_error(503, "No measurement available yet")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(record)))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(record)
+
+    def send_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        readings = self.server.readings
+        seq, record = readings.latest()
+        try:
+            #latest record is sent right away, then every new one
+            while True:
+                if record is not None:
+                    self.wfile.write(b"data: " + record + b"\n\n")
+                else:
+                    self.wfile.write(b": keep-alive\n\n")
+                self.wfile.flush()
+                seq, record = readings.wait_newer(seq, SSE_KEEPALIVE_INTERVAL)
+        except (BrokenPipeError, ConnectionResetError):
+            logging.debug('Live readings: stream client %s disconnected', self.client_address[0])
+
+    def log_message(self, format, *args):
+        logging.debug('Live readings: %s - ' + format, self.client_address[0], *args)
+
+
+def StartLiveReadingsServer(readings, address, port):
+    #starts http server in daemon thread, returns None if the port
+    #can not be opened, so thermometer keeps working without it
+    try:
+        server = ThreadingHTTPServer((address, port), LiveReadingsHandler)
+    except OSError:
+        logging.error('Live readings: failed to start server on %s:%i: %s', address, port, sys.exc_info()[1])
+        return None
+    server.daemon_threads = True
+    server.readings = readings
+    thread = threading.Thread(target = server.serve_forever, name = "LiveReadingsThread", daemon = True)
+    thread.start()
+    logging.info('Live readings: serving http://%s:%i/readings and /stream', address, port)
+    return server
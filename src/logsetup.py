@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+###############################################################
+# logsetup.py module configures logging of digitalthermometer #
+# and influxdbdatalogger daemons:                             #
+#     - records are put to in-memory queue by QueueHandler    #
+#       and formatted and written to stdout or log file by    #
+#       QueueListener thread, so log I/O never blocks the     #
+#       measurement loop or mqtt callbacks                    #
+#     - logging is reentrant, so signal handlers can log also #
+#       when they interrupt logging call of the main thread   #
+#     - repeated warnings (the same message from the same     #
+#       place in the code) are logged at most once per        #
+#       LOG_REPEAT_INTERVAL, number of suppressed repetitions #
+#       is added to the next logged warning, DEBUG and INFO   #
+#       records are never suppressed                          #
+#     - verbosity is switched between INFO and DEBUG at       #
+#       runtime with SIGRTMIN, i.e.: kill -RTMIN <pid>        #
+# Expensive arguments of debug messages should be evaluated   #
+# only if debug_enabled() returns True.                       #
+###############################################################
+
+import logging
+import logging.handlers
+import queue
+import threading
+import signal
+import multiprocessing.util
+import atexit
+import sys
+import os
+import time
+
+LOG_FORMAT = '%(asctime)s:%(threadName)s:%(filename)s:%(lineno)s:%(levelname)s:%(message)s'
+#Max number of records waiting for the listener, records are dropped when the queue is full,
+#limit is not exact, records put concurrently can exceed it slightly
+LOG_QUEUE_SIZE = 10000
+#Min interval between two identical WARNING records, in sec
+LOG_REPEAT_INTERVAL = 60
+#Max number of remembered distinct messages, remembered messages are
+#forgotten when the limit is reached
+LOG_REPEAT_MAX_KEYS = 1000
+#Signal switching between INFO and DEBUG level
+VERBOSITY_SIGNAL = signal.SIGRTMIN
+
+queue_handler = None
+listener = None
+
+
+class RepeatFilter(logging.Filter):
+    #Suppresses records of min_level to max_level repeated within interval,
+    #by default warnings only, errors and critical records are rate-limited
+    #only when max_level is raised
+
+    def __init__(self, interval=LOG_REPEAT_INTERVAL, min_level=logging.WARNING, max_level=logging.WARNING, max_keys=LOG_REPEAT_MAX_KEYS):
+        logging.Filter.__init__(self)
+        self.interval = interval
+        self.min_level = min_level
+        self.max_level = max_level
+        self.max_keys = max_keys
+        #reentrant, signal handler can log while main thread is in filter
+        self.lock = threading.RLock()
+        #last logged time and number of suppressed repetitions by message
+        self.seen = {}
+
+    def filter(self, record):
+        if record.levelno < self.min_level or record.levelno > self.max_level or getattr(record, "repeat_filter", True) == False:
+            return True
+        key = (record.pathname, record.lineno, record.getMessage())
+        now = time.monotonic()
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry is not None and now - entry[0] < self.interval:
+                entry[1] = entry[1] + 1
+                return False
+            if entry is None and len(self.seen) >= self.max_keys:
+                self.seen.clear()
+            self.seen[key] = [now, 0]
+        if entry is not None and entry[1] > 0:
+            record.msg = record.getMessage() + " (repeated %i times in %i sec)" % (entry[1], now - entry[0])
+            record.args = None
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    #Drops records when the listener does not keep up, instead of
+    #blocking the caller or growing memory without limit. Queue is
+    #SimpleQueue, which put() is reentrant, so logging from signal
+    #handler does not deadlock on mutex held by interrupted thread
+
+    def __init__(self, log_queue):
+        logging.handlers.QueueHandler.__init__(self, log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= LOG_QUEUE_SIZE:
+            self.dropped = self.dropped + 1
+        else:
+            self.queue.put_nowait(record)
+
+
+def StartListener(handlers):
+    global listener
+    log_queue = queue.SimpleQueue()
+    queue_handler.queue = log_queue
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+def RestartListenerInChild():
+    #listener thread does not survive fork, the queue may be locked by
+    #thread of the parent, so child process gets new queue and listener
+    if listener is not None:
+        StartListener(listener.handlers)
+
+def RegisterChildFinalizer(handler):
+    #atexit is not run by multiprocessing child processes, finalizers are,
+    #finalizers of the parent are removed after fork, so it is registered here
+    multiprocessing.util.Finalize(None, StopListener, exitpriority=0)
+
+def StopListener():
+    if listener is not None:
+        listener.stop()
+        if queue_handler.dropped:
+            #listener is stopped, so the record is written directly
+            for handler in listener.handlers:
+                handler.handle(logging.makeLogRecord({"msg": "Logging: %i records dropped, log queue was full" % queue_handler.dropped, "levelno": logging.WARNING, "levelname": "WARNING"}))
+
+def ConfigureLogging(program_file, log_all=False, log_to_file=False):
+    global queue_handler
+
+    if log_to_file == True:
+        #log file is stored next to the program, i.e. influxdbdatalogger.log
+        file_name_wo_extension = os.path.splitext(os.path.basename(program_file))[0]
+        log_file = os.path.dirname(os.path.realpath(program_file)) + "/" + file_name_wo_extension + ".log"
+        output_handler = logging.FileHandler(filename=log_file)
+        print ("Program logs are stored in: ", log_file)
+    else:
+        output_handler = logging.StreamHandler(sys.stdout)
+    output_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    #configure logger module
+    #levels: DEBUG,INFO,WARNING,ERROR,CRITICAL
+    queue_handler = NonBlockingQueueHandler(None)
+    #records are formatted by output handler in the listener thread
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
+    queue_handler.addFilter(RepeatFilter())
+    StartListener([output_handler])
+    logging.basicConfig(level = logging.DEBUG if log_all == True else logging.INFO, handlers=[queue_handler])
+    #records still in the queue are written at exit
+    atexit.register(StopListener)
+    os.register_at_fork(after_in_child=RestartListenerInChild)
+    multiprocessing.util.register_after_fork(queue_handler, RegisterChildFinalizer)
+
+    signal.signal(VERBOSITY_SIGNAL, ToggleVerbosity)
+
+def SetLogLevel(log_all):
+    logging.getLogger().setLevel(logging.DEBUG if log_all == True else logging.INFO)
+
+def ToggleVerbosity(signum, frame):
+    root = logging.getLogger()
+    if root.isEnabledFor(logging.DEBUG):
+        root.setLevel(logging.INFO)
+    else:
+        root.setLevel(logging.DEBUG)
+    logging.warning('Logging: level changed to %s', logging.getLevelName(root.getEffectiveLevel()), extra={"repeat_filter": False})
+
+def debug_enabled():
+    #guard for debug messages with expensive arguments, level can change at runtime
+    return logging.root.isEnabledFor(logging.DEBUG)
@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+
+###############################################################
+# mqttpublisher.py module publishes measurement records of    #
+# digitalthermometer to several MQTT brokers (sinks), i.e.    #
+# local broker of on-site logger and remote one used for      #
+# central aggregation:                                        #
+#     - every sink has its own connection, QoS, topic         #
+#       template and reconnect state                          #
+#     - record is serialized once by the caller, the same     #
+#       bytes are queued to every sink                        #
+#     - every sink has bounded queue and its own thread, so   #
+#       slow or unreachable broker neither blocks the other   #
+#       sinks nor the measurement loop, the oldest records    #
+#       are dropped when the queue is full                    #
+# Topic template can use {topic} and {hostname} fields.       #
+# Sinks can be replaced at runtime (see reconfigure), records #
+# queued to replaced sink are taken over by the new one.      #
+###############################################################
+
+import threading
+import logging
+import socket
+import sys
+from collections import deque
+
+#Default number of records kept by sink while its broker is not reachable
+DEFAULT_QUEUE_SIZE = 600
+#Time sink waits for broker to accept more messages, when client queue is full, in sec
+QUEUE_FULL_RETRY_DELAY = 1.0
+
+
+class MqttSink(threading.Thread):
+
+    def __init__(self, name, host, port=1883, qos=1, topic_template="{topic}", base_topic="", keepalive=60, reconnect_delay_min=1, reconnect_delay_max=60, queue_size=DEFAULT_QUEUE_SIZE):
+        threading.Thread.__init__(self, name="MqttSink-" + name, daemon=True)
+        self.sink_name = name
+        self.host = host
+        self.port = port
+        if qos != 0 and qos != 1:
+            logging.warning('MQTT %s: QoS %s is not supported. Default QoS=1 is used...', name, qos)
+            qos = 1
+        self.qos = qos
+        self.topic = topic_template.format(topic=base_topic, hostname=socket.gethostname())
+        self.keepalive = keepalive
+        self.reconnect_delay_min = reconnect_delay_min
+        self.reconnect_delay_max = reconnect_delay_max
+        self.queue = deque()
+        self.queue_size = queue_size
+        #sink is replaced at reconfiguration only if its parameters change
+        self.params = (host, port, qos, self.topic, keepalive, reconnect_delay_min, reconnect_delay_max, queue_size)
+        self.condition = threading.Condition()
+        self.connected_flag = False
+        #incremented at every connection, so publish failed on the previous
+        #connection does not clear connected_flag of the new one
+        self.connection_no = 0
+        self.stopping = False
+        self.client = None
+        #records dropped due to full queue since the last report
+        self.dropped = 0
+
+    def start(self):
+        import paho.mqtt.client as mqtt
+        self.mqtt = mqtt
+        self.client = mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
+        #messages waiting for broker are limited by our queue, not by the client
+        self.client.max_queued_messages_set(self.queue_size)
+        #connection is established by network loop thread, which keeps on
+        #reconnecting in the background if broker is not reachable or
+        #connection is lost
+        self.client.reconnect_delay_set(self.reconnect_delay_min, self.reconnect_delay_max)
+        logging.info('MQTT %s: Sent:MQTT_CONNECT:(IP:%s,TCP Port:%s,Topic:%s,QoS:%i,KeepAlive:%i)', self.sink_name, self.host, self.port, self.topic, self.qos, self.keepalive)
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+        threading.Thread.start(self)
+
+    def on_connect(self, client, userdata, flags, rc):
+        logging.info('MQTT %s: Received:MQTT_CONNACK(rc=%i)', self.sink_name, rc)
+        if rc == 0:
+            logging.info('MQTT %s: Connection to MQTT Broker established!', self.sink_name)
+            with self.condition:
+                self.connected_flag = True
+                self.connection_no = self.connection_no + 1
+                if self.dropped:
+                    logging.warning('MQTT %s: %i records dropped while broker was not reachable', self.sink_name, self.dropped)
+                    self.dropped = 0
+                self.condition.notify()
+        else:
+            logging.info('MQTT %s: Connection establishment to MQTT Broker failed!', self.sink_name)
+
+    def on_disconnect(self, client, userdata, rc):
+        with self.condition:
+            self.connected_flag = False
+        if rc == 0:
+            logging.info('MQTT %s: Disconnection from MQTT Broker completed!', self.sink_name)
+        else:
+            logging.error('MQTT %s: Unexpected disconnection from MQTT Broker, reconnecting in background...', self.sink_name)
+
+    def on_publish(self, client, userdata, mid):
+        if self.qos == 1:
+            logging.debug('MQTT %s: Received:MQTT_PUBACK(mid=%i)', self.sink_name, mid)
+        with self.condition:
+            self.condition.notify()
+
+    def offer(self, topic, payload):
+        #never blocks, the oldest record is dropped when the queue is full
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                self.queue.popleft()
+                if self.dropped == 0:
+                    logging.warning('MQTT %s: queue is full, dropping the oldest records...', self.sink_name)
+                self.dropped = self.dropped + 1
+            self.queue.append((topic or self.topic, payload))
+            self.condition.notify()
+
+    def take_over(self, sink):
+        #records not sent by stopped sink are sent by this one
+        with sink.condition:
+            records = list(sink.queue)
+            sink.queue.clear()
+        with self.condition:
+            for topic, payload in records[-self.queue_size:]:
+                #records of the old topic template are sent on the new topic
+                self.queue.append((self.topic if topic == sink.topic else topic, payload))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.stopping == False and (self.connected_flag == False or not self.queue):
+                    self.condition.wait()
+                if self.stopping == True:
+                    break
+                topic, payload = self.queue.popleft()
+                connection_no = self.connection_no
+            try:
+                result = self.client.publish(topic, payload, self.qos)
+            except ValueError:
+                #invalid topic or too large payload, sending it again would fail too
+                logging.error('MQTT %s: publishing failed: %s, record dropped', self.sink_name, sys.exc_info()[1])
+                continue
+            logging.debug('MQTT %s: Sent:MQTT_PUBLISH(mid=%i, topic:%s, QoS=%i, rc=%i)', self.sink_name, result.mid, topic, self.qos, result.rc)
+            if result.rc == self.mqtt.MQTT_ERR_SUCCESS:
+                continue
+            with self.condition:
+                #QoS 1 message not sent due to lost connection is kept by the
+                #client and sent after reconnection, so it is not queued again
+                if result.rc == self.mqtt.MQTT_ERR_QUEUE_SIZE or (result.rc == self.mqtt.MQTT_ERR_NO_CONN and self.qos == 0):
+                    if len(self.queue) < self.queue_size:
+                        self.queue.appendleft((topic, payload))
+                    else:
+                        self.dropped = self.dropped + 1
+                if result.rc == self.mqtt.MQTT_ERR_NO_CONN:
+                    #connection is lost, but on_disconnect was not called yet,
+                    #publishing is resumed by on_connect
+                    if connection_no == self.connection_no:
+                        self.connected_flag = False
+                elif result.rc == self.mqtt.MQTT_ERR_QUEUE_SIZE:
+                    self.condition.wait(QUEUE_FULL_RETRY_DELAY)
+                else:
+                    logging.error('MQTT %s: publishing failed (rc=%i), record dropped', self.sink_name, result.rc)
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.client is not None:
+            self.client.loop_stop()
+            logging.info('MQTT %s: Sent:MQTT_DISCONNECT', self.sink_name)
+            self.client.disconnect()
+
+
+class MqttPublisher:
+    #Fan-out of serialized records to all sinks
+
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def start(self):
+        for sink in self.sinks:
+            sink.start()
+
+    def publish(self, payload, topic=None):
+        #payload is the same bytes object for every sink, topic overrides
+        #topic template of the sinks, i.e. for alert events
+        for sink in self.sinks:
+            sink.offer(topic, payload)
+
+    def reconfigure(self, sinks):
+        #sinks with unchanged parameters keep their connection, changed
+        #ones are replaced by not started sinks of the same name
+        current = {sink.sink_name: sink for sink in self.sinks}
+        new_sinks = []
+        for sink in sinks:
+            old = current.pop(sink.sink_name, None)
+            if old is not None and old.params == sink.params:
+                new_sinks.append(old)
+                continue
+            if old is not None:
+                logging.info('MQTT %s: broker settings changed, reconnecting...', sink.sink_name)
+                old.stop()
+                sink.take_over(old)
+            sink.start()
+            new_sinks.append(sink)
+        for old in current.values():
+            logging.info('MQTT %s: broker removed, %i queued records dropped', old.sink_name, len(old.queue))
+            old.stop()
+        self.sinks = new_sinks
+
+    def is_connected(self):
+        #True if at least one sink is connected to its broker
+        for sink in self.sinks:
+            if sink.connected_flag == True:
+                return True
+        return False
+
+    def stop(self):
+        for sink in self.sinks:
+            sink.stop()
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+###############################################################
+# profilinghooks.py module provides on-demand diagnostics     #
+# for the long running daemons (digitalthermometer and        #
+# influxdbdatalogger). Main functions of the module are:      #
+#     - SIGUSR1 starts/stops sampling profiler for the        #
+#       configured time window                                #
+#     - SIGUSR2 dumps stacks of all threads and top memory    #
+#       allocations collected by tracemalloc                  #
+#     - StageTimer collects per-stage timing of main loop     #
+# Reports are written to the working directory, i.e.:        #
+#     kill -USR1 <pid>  ->  <program>_profile_<time>.txt      #
+#     kill -USR2 <pid>  ->  <program>_stacks_<time>.txt       #
+###############################################################
+
+import time
+import threading
+import signal
+import logging
+import sys
+import os
+import traceback
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+#Number of stack frames stored by tracemalloc for every allocation
+TRACEMALLOC_FRAMES = 10
+#Number of entries printed in every section of the reports
+REPORT_TOP_ENTRIES = 25
+
+
+class _Stage:
+    #Reusable context manager measuring single stage of the loop,
+    #created once per stage name so timing does not allocate
+    __slots__ = ("name", "count", "total", "max", "t0", "lock")
+
+    def __init__(self, name, lock):
+        self.name = name
+        self.lock = lock
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.t0 = 0.0
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.perf_counter() - self.t0
+        with self.lock:
+            self.count = self.count + 1
+            self.total = self.total + elapsed
+            if elapsed > self.max:
+                self.max = elapsed
+        return False
+
+
+class StageTimer:
+    #Collects number of calls, total and max execution time of
+    #named stages of the main loop, i.e.:
+    #    with stage_timer.stage("display"):
+    #        display_manager.show_measurements(...)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def stage(self, name):
+        stg = self.stages.get(name)
+        if stg is None:
+            stg = self.stages.setdefault(name, _Stage(name, self.lock))
+        return stg
+
+    def reset(self):
+        with self.lock:
+            for stg in self.stages.values():
+                stg.count = 0
+                stg.total = 0.0
+                stg.max = 0.0
+
+    def summary(self):
+        lines = ["%-20s %10s %12s %12s %12s" % ("stage", "count", "total[s]", "avg[ms]", "max[ms]")]
+        with self.lock:
+            stages = [(stg.name, stg.count, stg.total, stg.max) for stg in self.stages.values()]
+        for name, count, total, maxtime in sorted(stages, key=lambda s: s[2], reverse=True):
+            avg = (total / count) if count else 0.0
+            lines.append("%-20s %10i %12.3f %12.3f %12.3f" % (name, count, total, avg * 1000, maxtime * 1000))
+        return "\n".join(lines)
+
+
+class StackSampler(threading.Thread):
+    #Sampling profiler: periodically takes stacks of all threads
+    #(except itself) and counts in which functions the program
+    #spends time. Unlike cProfile it covers every thread and adds
+    #no overhead to the profiled code.
+
+    def __init__(self, report_file, window, interval, stage_timer=None):
+        threading.Thread.__init__(self, name="StackSampler", daemon=True)
+        self.report_file = report_file
+        self.window = window
+        self.interval = interval
+        self.stage_timer = stage_timer
+        self.stop_event = threading.Event()
+        self.samples = 0
+        #leaf frame counts - time spent in function itself
+        self.self_counts = Counter()
+        #every function on the stack counted once - time spent in function and its callees
+        self.total_counts = Counter()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def take_sample(self):
+        names = {thr.ident: thr.name for thr in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == self.ident:
+                continue
+            thread_name = names.get(thread_id, str(thread_id))
+            leaf = True
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                key = (thread_name, code.co_filename, code.co_firstlineno, code.co_name)
+                if leaf:
+                    self.self_counts[key + (frame.f_lineno,)] += 1
+                    leaf = False
+                if key not in seen:
+                    seen.add(key)
+                    self.total_counts[key] += 1
+                frame = frame.f_back
+        self.samples = self.samples + 1
+
+    def run(self):
+        started = time.monotonic()
+        if self.stage_timer is not None:
+            self.stage_timer.reset()
+        logging.info('Profiler: sampling started for %i sec, report: %s', self.window, self.report_file)
+        deadline = started + self.window
+        while not self.stop_event.wait(self.interval) and time.monotonic() < deadline:
+            self.take_sample()
+        duration = time.monotonic() - started
+        try:
+            self.write_report(duration)
+            logging.info('Profiler: sampling finished after %.1f sec, report stored in: %s', duration, self.report_file)
+        except OSError:
+            logging.error('Profiler: failed to store report: %s', sys.exc_info()[1])
+
+    def write_report(self, duration):
+        with open(self.report_file, "w") as f:
+            f.write("Sampling profile of pid %i, %i samples in %.1f sec (interval %.1f ms)\n\n"
+                    % (os.getpid(), self.samples, duration, self.interval * 1000))
+            if self.stage_timer is not None:
+                f.write("Per-stage timing summary:\n")
+                f.write(self.stage_timer.summary() + "\n\n")
+            samples = max(self.samples, 1)
+            f.write("Top functions by own time (leaf frames):\n")
+            for (thread_name, filename, firstline, func, lineno), count in self.self_counts.most_common(REPORT_TOP_ENTRIES):
+                f.write("%6.1f%%  %-18s %s (%s:%i)\n" % (100.0 * count / samples, thread_name, func, filename, lineno))
+            f.write("\nTop functions by cumulative time (incl. callees):\n")
+            for (thread_name, filename, firstline, func), count in self.total_counts.most_common(REPORT_TOP_ENTRIES):
+                f.write("%6.1f%%  %-18s %s (%s:%i)\n" % (100.0 * count / samples, thread_name, func, filename, firstline))
+
+
+def _report_file_name(output_dir, program_name, kind):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    return os.path.join(output_dir, program_name + "_" + kind + "_" + timestamp + ".txt")
+
+
+def dump_stacks_and_allocations(report_file):
+    #Writes stacks of all threads and top memory allocations to report file.
+    #tracemalloc is started at the first dump, so allocation statistics
+    #are available from the second dump on
+    names = {thr.ident: thr.name for thr in threading.enumerate()}
+    with open(report_file, "w") as f:
+        f.write("Thread stacks of pid %i:\n" % os.getpid())
+        for thread_id, frame in sys._current_frames().items():
+            f.write("\nThread %s (%i):\n" % (names.get(thread_id, "?"), thread_id))
+            f.write("".join(traceback.format_stack(frame)))
+        f.write("\n")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            f.write("tracemalloc started now, send SIGUSR2 again to get allocation statistics\n")
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        f.write("tracemalloc: current %.1f KiB, peak %.1f KiB\n" % (current / 1024, peak / 1024))
+        snapshot = tracemalloc.take_snapshot()
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        f.write("\nTop allocations by line:\n")
+        for stat in snapshot.statistics("lineno")[:REPORT_TOP_ENTRIES]:
+            f.write("%s\n" % stat)
+        f.write("\nTop allocations by traceback:\n")
+        for stat in snapshot.statistics("traceback")[:5]:
+            f.write("%s\n" % stat)
+            f.write("".join("    " + line + "\n" for line in stat.traceback.format()))
+
+
+def install_profiling_hooks(program_name, stage_timer=None, window=30, interval=0.01, output_dir=None):
+    #Installs SIGUSR1 and SIGUSR2 handlers, has to be called from main thread
+    if output_dir is None:
+        output_dir = os.getcwd()
+    state = {"sampler": None}
+
+    def handleSIGUSR1(signum, frame):
+        sampler = state["sampler"]
+        if sampler is not None and sampler.is_alive():
+            logging.info('Profiler: SIGUSR1 received, stopping sampling...')
+            sampler.stop()
+            return
+        sampler = StackSampler(_report_file_name(output_dir, program_name, "profile"), window, interval, stage_timer)
+        state["sampler"] = sampler
+        sampler.start()
+
+    def handleSIGUSR2(signum, frame):
+        report_file = _report_file_name(output_dir, program_name, "stacks")
+        try:
+            dump_stacks_and_allocations(report_file)
+            logging.info('Profiler: thread stacks and allocations stored in: %s', report_file)
+        except OSError:
+            logging.error('Profiler: failed to store stack dump: %s', sys.exc_info()[1])
+
+    signal.signal(signal.SIGUSR1, handleSIGUSR1)
+    signal.signal(signal.SIGUSR2, handleSIGUSR2)
+    logging.info('Profiler: hooks installed, SIGUSR1 - %i sec sampling profile, SIGUSR2 - stacks and allocations', window)
@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+###############################################################
+# sdnotify.py module implements systemd service notification  #
+# protocol (sd_notify) with plain unix datagram socket, so no #
+# native systemd library is needed:                           #
+#     - sd_notify("READY=1") - service start-up completed     #
+#     - WatchdogNotifier     - sends "WATCHDOG=1" pings, rate #
+#                              limited to half of WatchdogSec #
+# Without NOTIFY_SOCKET (i.e. started from command line) all  #
+# functions do nothing.                                       #
+###############################################################
+
+import os
+import socket
+import time
+import logging
+import sys
+
+_notify_socket = None
+
+
+def sd_notify(state):
+    #sends state string to systemd, returns True if it was sent
+    global _notify_socket
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+    if address[0] == "@":
+        #abstract namespace socket
+        address = "\0" + address[1:]
+    try:
+        if _notify_socket is None:
+            _notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+        _notify_socket.sendto(state.encode(), address)
+        return True
+    except OSError:
+        logging.warning('sd_notify: failed to send "%s": %s', state, sys.exc_info()[1])
+        return False
+
+
+def watchdog_interval():
+    #returns WatchdogSec of the service in sec or None when watchdog
+    #is not enabled for this process
+    usec = os.environ.get("WATCHDOG_USEC")
+    if not usec:
+        return None
+    pid = os.environ.get("WATCHDOG_PID")
+    if pid and int(pid) != os.getpid():
+        return None
+    return int(usec) / 1000000.0
+
+
+class WatchdogNotifier:
+    #Sends watchdog pings, ping() is cheap enough to be called every
+    #loop cycle, datagram is sent only every half of watchdog interval
+
+    def __init__(self):
+        self.interval = watchdog_interval()
+        self.last_ping = None
+        if self.interval is not None:
+            logging.info('sd_notify: watchdog enabled, interval %.1f sec', self.interval)
+
+    def ping(self, now=None):
+        if self.interval is None:
+            return
+        if now is None:
+            now = time.monotonic()
+        if self.last_ping is None or now - self.last_ping >= self.interval / 2:
+            self.last_ping = now
+            sd_notify("WATCHDOG=1")
@@ -0,0 +1,531 @@
+#!/usr/bin/python3
+
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+###############################################################
+# thermometerdisplay.py module contains display functions of  #
+# digitalthermometer:                                         #
+#     - initialization of ST7789 based 240x240px display      #
+#     - rendering of measurement screen                       #
+#     - FrameRenderer drawing frames into preallocated image  #
+#       and RGB565 buffers                                    #
+#     - FrameCache memoizing rendered frames                  #
+#     - DisplayPowerManager, which switches backlight and     #
+#       panel sleep mode and skips rendering and SPI          #
+#       transfers while the display is off                    #
+#     - DisplayRenderWorker, which optionally runs rendering  #
+#       and SPI transfers in separate process                 #
+###############################################################
+
+#Below line is required to use *C sign
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import signal
+import sys
+import multiprocessing
+from threading import Lock
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#String shown on the display instead of value of not available sensor
+NO_READING_STR = "--"
+
+# Config for display baudrate (default max is 24mhz):
+BAUDRATE = 64000000
+#Display resolution and GPIO pin (board module name) of the backlight
+DISPLAY_WIDTH = 240
+DISPLAY_HEIGHT = 240
+BACKLIGHT_PIN = "D22"
+#Max time to wait for render worker to clear the screen at exit, in sec
+RENDER_WORKER_STOP_TIMEOUT = 5
+
+FONT_FILE = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+#fonts are loaded once and shared by all renderers
+_fonts = None
+
+def IsSingleDigit(valstr):
+    #sensor not available string is laid out as two digit value
+    return valstr != NO_READING_STR and abs(int(valstr)) < 10
+
+def IsNonNegative(valstr):
+    return valstr == NO_READING_STR or int(valstr) >= 0
+
+def LoadFonts():
+    global _fonts
+    if _fonts is None:
+        # Alternatively load a TTF font.  Make sure the .ttf font file is in the
+        # same directory as the python script!
+        # Some other nice fonts to try: http://www.dafont.com/bitmap.php
+        fontTQtyValue = ImageFont.truetype(FONT_FILE, 104)
+        fontTQtyDeco = ImageFont.truetype(FONT_FILE, 30)
+        fontTQtyDecoSmall = ImageFont.truetype(FONT_FILE, 20)
+        _fonts = (fontTQtyValue, fontTQtyDeco, fontTQtyDecoSmall, fontTQtyDecoSmall)
+    return _fonts
+
+#####
+def DrawMeasurements(draw,fonts,width,height,font_color_primary, font_color_secondary,bg_color,intemperaturevalstr,inpressurevalstr,inhumidityvalstr,outtemperaturevalstr):
+    #draws measurement screen over the whole image of given draw object
+    fontTQtyValue, fontTQtyDeco, fontTQtyDecoSmall, fontOtherInfo = fonts
+
+    # Draw a black filled box to clear the image.
+    #draw.rectangle((0, 0, width, height), outline=0, fill=(26, 163, 255))
+    draw.rectangle((0, 0, width, height), outline=0, fill=bg_color)
+    
+    ###############################
+    #Print indoor temperature value
+    ###############################
+    
+    #Print Temperature Indicator, possible value: "T="
+    if IsSingleDigit(intemperaturevalstr):
+        #temperature value is single digit
+        tqtystr_pos_x=50
+    else:
+        tqtystr_pos_x=10
+        
+    indoort_str_pos_base_y = 25
+        
+    tqtystr_pos_y = indoort_str_pos_base_y
+    tqtystr="T"
+    draw.text((tqtystr_pos_x, tqtystr_pos_y), tqtystr, font=fontTQtyDeco, fill=font_color_primary)
+    tqtystr_pos_x = tqtystr_pos_x + fontTQtyDeco.getsize(tqtystr)[0] - 5
+    tqtystr_pos_y = tqtystr_pos_y + fontTQtyDeco.getsize(tqtystr)[1] - 18
+    tqtystr="in"
+    draw.text((tqtystr_pos_x, tqtystr_pos_y), tqtystr, font=fontTQtyDecoSmall, fill=font_color_primary)
+    tqtystr_pos_y = indoort_str_pos_base_y
+    tqtystr_pos_x = tqtystr_pos_x + fontTQtyDecoSmall.getsize(tqtystr)[0]
+    tqtystr="="
+    draw.text((tqtystr_pos_x, tqtystr_pos_y), tqtystr, font=fontTQtyDeco, fill=font_color_primary)
+
+    #Print Temperature Value, possible value: "+/- xxx"
+    tvalstr_pos_x= tqtystr_pos_x -12
+    tvalstr_pos_y= tqtystr_pos_y -10
+    
+    if IsNonNegative(intemperaturevalstr):
+        #temperature value is positive, need to insert space in front of digit...
+        intemperaturevalstr = " " + intemperaturevalstr
+        
+    draw.text((tvalstr_pos_x, tvalstr_pos_y), intemperaturevalstr, font=fontTQtyValue, fill=font_color_primary)
+
+    #Print Temperature Unit, possible value: "*C"
+    tunitstr_pos_x = tvalstr_pos_x + fontTQtyValue.getsize(intemperaturevalstr)[0] - 5
+    tunitstr_pos_y = tqtystr_pos_y
+    tunitstr=chr(176)+"C"
+    draw.text((tunitstr_pos_x, tunitstr_pos_y), tunitstr, font=fontTQtyDeco, fill=font_color_primary)
+    
+    
+    ################################
+    #Print outdoor temperature value
+    ################################
+    
+    outdoort_str_pos_base_x = 30
+    outdoort_str_pos_base_y = 130
+    
+    outtstr=""
+    if IsNonNegative(outtemperaturevalstr):
+        #temperature value is positive - add extra white space
+        outtstr = " " + outtstr
+    if IsSingleDigit(outtemperaturevalstr):
+        #temperature value is single digit - add extra white space
+        outtstr = " " + outtstr
+    
+    outtstr = outtstr + "[T"
+    draw.text((outdoort_str_pos_base_x, outdoort_str_pos_base_y), outtstr, font=fontTQtyDeco, fill=font_color_primary)
+    
+    outdoortstr_pos_x = outdoort_str_pos_base_x + fontTQtyDeco.getsize(outtstr)[0] - 5
+    outdoortstr_pos_y = outdoort_str_pos_base_y + fontTQtyDeco.getsize(outtstr)[1] - 22
+    outtstr = "out"
+    draw.text((outdoortstr_pos_x, outdoortstr_pos_y), outtstr, font=fontTQtyDecoSmall, fill=font_color_primary)
+    outdoortstr_pos_x = outdoortstr_pos_x + fontTQtyDecoSmall.getsize(outtstr)[0]
+    unitstr = chr(176) + "C]"
+    outtstr = "=" + outtemperaturevalstr + unitstr
+    draw.text((outdoortstr_pos_x, outdoort_str_pos_base_y), outtstr, font=fontTQtyDeco, fill=font_color_primary)
+    
+    ticker_pos_x = outdoortstr_pos_x + fontTQtyDeco.getsize(outtstr)[0] + 5
+    ticker_pos_y = outdoortstr_pos_y + 5
+    tickerstr=chr(187)+chr(171)
+    draw.text((ticker_pos_x, ticker_pos_y), tickerstr, font=fontTQtyDecoSmall, fill=font_color_secondary)
+    
+    #Draw division lines
+    horizontalline_pos_y = 170
+    draw.line((0,horizontalline_pos_y, width,horizontalline_pos_y), fill=font_color_primary)
+    draw.line((width/2,horizontalline_pos_y, width/2,height), fill=font_color_primary)
+
+
+    #Print Pressure reading if available
+    pqtystr_pos_x = 5
+    pqtystr_pos_y = horizontalline_pos_y + 5
+    pqtystr = "P="
+    draw.text((pqtystr_pos_x, pqtystr_pos_y), pqtystr, font=fontOtherInfo, fill=font_color_primary)
+
+ 
+    pvalstr=inpressurevalstr + " hPa"
+    
+    pvalstr_pos_x = pqtystr_pos_x + 10
+    pvalstr_pos_y = pqtystr_pos_y + fontOtherInfo.getsize(pvalstr)[1] + 10
+    draw.text((pvalstr_pos_x, pvalstr_pos_y), pvalstr, font=fontOtherInfo, fill=font_color_primary)
+
+    #Print Humidity reading if available
+    hqtystr_pos_x = (width/2) + 5
+    hqtystr_pos_y = pqtystr_pos_y
+
+    hqtystr = "H="
+    draw.text((hqtystr_pos_x, hqtystr_pos_y), hqtystr, font=fontOtherInfo, fill=font_color_primary)
+
+    hvalstr= inhumidityvalstr + " %"
+
+    hvalstr_pos_x = hqtystr_pos_x + 30
+    hvalstr_pos_y = hqtystr_pos_y + fontOtherInfo.getsize(hvalstr)[1] + 10
+    draw.text((hvalstr_pos_x, hvalstr_pos_y), hvalstr, font=fontOtherInfo, fill=font_color_primary)
+
+def ImageToRGB565(image,image_rotation):
+    #converts image to display's native 16 bit RGB565 big endian format,
+    #the same conversion is done by display.image() at every call
+    if image_rotation != 0:
+        image = image.rotate(image_rotation, expand=True)
+    if numpy is not None:
+        data = numpy.asarray(image, dtype=numpy.uint16)
+        color = ((data[:, :, 0] & 0xF8) << 8) | ((data[:, :, 1] & 0xFC) << 3) | (data[:, :, 2] >> 3)
+        return color.astype(">u2").tobytes()
+    # Slower but doesn't require numpy
+    width, height = image.size
+    pixels = bytearray(width * height * 2)
+    i = 0
+    for r, g, b in image.getdata():
+        pix = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+        pixels[i] = pix >> 8
+        pixels[i + 1] = pix & 0xFF
+        i = i + 2
+    return bytes(pixels)
+
+class FrameRenderer:
+    #Renders measurement frames into image, draw object and RGB565 frame
+    #buffer allocated once, so the measurement loop does not allocate
+    #large objects for every frame. Returned frame buffer is overwritten
+    #by the next render() call.
+
+    def __init__(self, width, height, image_rotation=0):
+        self.width = width
+        self.height = height
+        self.image_rotation = image_rotation
+        self.image = Image.new("RGB", (width, height))
+        self.draw = ImageDraw.Draw(self.image)
+        self.fonts = LoadFonts()
+        self.frame = bytearray(width * height * 2)
+        #numpy work arrays, allocated at the first conversion
+        self.channel = None
+        self.color = None
+        self.pixels = None
+
+    def render(self, frame_args):
+        #frame_args are DrawMeasurements() arguments following width and height
+        DrawMeasurements(self.draw, self.fonts, self.width, self.height, *frame_args)
+        return self.convert()
+
+    def convert(self):
+        image = self.image
+        if self.image_rotation != 0:
+            image = image.rotate(self.image_rotation, expand=True)
+        if numpy is None:
+            self.frame[:] = ImageToRGB565(image, 0)
+            return self.frame
+        data = numpy.asarray(image)
+        if self.color is None:
+            self.channel = numpy.empty(data.shape[:2], dtype=numpy.uint16)
+            self.color = numpy.empty(data.shape[:2], dtype=numpy.uint16)
+            self.pixels = numpy.frombuffer(self.frame, dtype=">u2").reshape(data.shape[:2])
+        #the same conversion as in ImageToRGB565(), done in place
+        numpy.bitwise_and(data[:, :, 0], 0xF8, out=self.color)
+        numpy.left_shift(self.color, 8, out=self.color)
+        numpy.bitwise_and(data[:, :, 1], 0xFC, out=self.channel)
+        numpy.left_shift(self.channel, 3, out=self.channel)
+        numpy.bitwise_or(self.color, self.channel, out=self.color)
+        numpy.right_shift(data[:, :, 2], 3, out=self.channel)
+        numpy.bitwise_or(self.color, self.channel, out=self.color)
+        self.pixels[...] = self.color
+        return self.frame
+
+def PushFrame(display,frame):
+    #sends already converted RGB565 frame to the display RAM
+    display._block(0, 0, display.width - 1, display.height - 1, frame)
+
+
+class FrameCache:
+    #LRU cache of display frames converted to RGB565. Display shows only
+    #rounded values and ticker alternates between two colors, so the same
+    #frames repeat over and over and cached frame is sent to the display
+    #without rendering nor conversion.
+    #Key is tuple of all DrawMeasurements() arguments following width
+    #and height. Every frame takes width*height*2 bytes (112.5KiB for
+    #240x240px display).
+
+    def __init__(self, max_frames):
+        self.max_frames = max_frames
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        frame = self.frames.get(key)
+        if frame is None:
+            self.misses = self.misses + 1
+            return None
+        self.hits = self.hits + 1
+        self.frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame):
+        if self.max_frames <= 0:
+            return
+        self.frames[key] = frame
+        self.frames.move_to_end(key)
+        while len(self.frames) > self.max_frames:
+            self.frames.popitem(last=False)
+
+    def clear(self):
+        self.frames.clear()
+
+def ClearDisplay(display,image_rotation):
+    height = display.width
+    width = display.height
+    image = Image.new("RGB", (width, height))
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, width, height), outline=0, fill=(0, 0, 0))
+    display.image(image, image_rotation)
+    
+
+def InitializeDisplay():
+    import digitalio
+    import board
+    import adafruit_rgb_display.st7789 as st7789
+
+    # Configuration for CS and DC pins (these are FeatherWing defaults on M0/M4):
+    cs_pin = digitalio.DigitalInOut(board.CE0)
+    dc_pin = digitalio.DigitalInOut(board.D25)
+    reset_pin = None
+
+    # Setup SPI bus using hardware SPI:
+    spi = board.SPI()
+
+    # Create the ST7789 display:
+    return st7789.ST7789(
+        spi,
+        cs=cs_pin,
+        dc=dc_pin,
+        rst=reset_pin,
+        baudrate=BAUDRATE,
+        width=DISPLAY_WIDTH,
+        height=DISPLAY_HEIGHT,
+        x_offset=0,
+        y_offset=80,
+    )
+
+
+#ST7789 commands used to put panel into sleep mode and wake it up
+ST7789_SLPIN = 0x10
+ST7789_SLPOUT = 0x11
+#Panel needs 120ms after SLPOUT before it accepts SLPIN (and 5ms before
+#any other command), see ST7789VW datasheet chapter 9.1.11 and 9.1.12
+ST7789_SLPOUT_DELAY = 0.120
+
+
+class DisplayPowerManager:
+    #Owns display and its backlight. While backlight is off measurement
+    #frames are not rendered nor sent over SPI, only the latest values
+    #are kept, so the current state is drawn once when display is turned
+    #on again. Optionally the panel is put into sleep mode (SLPIN) while
+    #the backlight is off.
+    #Frames are rendered from the measurement loop and toggle() is called
+    #from button handling thread, so both are serialized with the lock.
+    #Rendered frames are memoized in optional FrameCache.
+
+    def __init__(self, display, backlight, image_rotation=0, sleep_panel=True, frame_cache=None):
+        self.display = display
+        self.backlight = backlight
+        self.image_rotation = image_rotation
+        self.sleep_panel = sleep_panel
+        self.lock = Lock()
+        self.display_on = backlight.value
+        #display driver wakes the panel up at initialization
+        self.panel_sleeping = False
+        self.frame_cache = frame_cache
+        # we swap height/width to rotate it to landscape!
+        self.renderer = FrameRenderer(display.height, display.width, image_rotation)
+        #arguments of the latest frame requested by measurement loop
+        self.frame_args = None
+        #arguments of the frame which is currently in display RAM
+        self.shown_frame_args = None
+
+    def show_measurements(self, *frame_args):
+        #frame_args are DrawMeasurements() arguments following width and height
+        with self.lock:
+            self.frame_args = frame_args
+            if self.display_on == True:
+                self.draw_frame(frame_args)
+
+    def draw_frame(self, frame_args):
+        #frame identical to the one in display RAM is not rendered nor sent again
+        if frame_args == self.shown_frame_args:
+            return
+        frame = None
+        if self.frame_cache is not None:
+            frame = self.frame_cache.get(frame_args)
+        if frame is None:
+            frame = self.renderer.render(frame_args)
+            if self.frame_cache is not None:
+                #renderer buffer is reused, cache keeps its own copy
+                self.frame_cache.put(frame_args, bytes(frame))
+        PushFrame(self.display, frame)
+        self.shown_frame_args = frame_args
+
+    def toggle(self):
+        with self.lock:
+            if self.display_on == True:
+                self.turn_off()
+            else:
+                self.turn_on()
+
+    def turn_off(self):
+        logging.info('Backlight is Off!')
+        self.backlight.value = False
+        self.display_on = False
+        if self.sleep_panel == True:
+            self.display.write(ST7789_SLPIN)
+            self.panel_sleeping = True
+
+    def wake_panel(self):
+        if self.panel_sleeping == True:
+            self.display.write(ST7789_SLPOUT)
+            time.sleep(ST7789_SLPOUT_DELAY)
+            self.panel_sleeping = False
+
+    def turn_on(self):
+        self.wake_panel()
+        #redraw the current state before backlight goes on, so the
+        #outdated frame from before switching off is never visible
+        if self.frame_args is not None:
+            self.draw_frame(self.frame_args)
+        logging.info('Backlight is On!')
+        self.backlight.value = True
+        self.display_on = True
+
+    def clear(self):
+        #clears the screen and turns backlight off, used at program exit
+        with self.lock:
+            self.wake_panel()
+            ClearDisplay(self.display, self.image_rotation)
+            self.shown_frame_args = None
+            self.backlight.value = False
+            self.display_on = False
+
+
+def DisplayRenderWorkerMain(conn, sleep_panel, frame_cache_size):
+    #Render worker process: owns display and backlight, renders frames and
+    #pushes them over SPI. Only the latest frame of
+    #all pending messages is rendered, so the worker never lags behind.
+    #Signals are handled by main process, which stops the worker at exit.
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import digitalio
+    import board
+
+    backlight = digitalio.DigitalInOut(getattr(board, BACKLIGHT_PIN))
+    backlight.switch_to_output()
+    manager = DisplayPowerManager(InitializeDisplay(), backlight, 0, sleep_panel, FrameCache(frame_cache_size))
+    logging.info('Render worker: started (pid %i)', multiprocessing.current_process().pid)
+    frame_args = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            #main process is gone
+            break
+        if message[0] == "frame":
+            frame_args = message[1]
+            if conn.poll():
+                continue
+        #pending frame is shown before any other command is executed
+        if frame_args is not None:
+            manager.show_measurements(*frame_args)
+            frame_args = None
+        if message[0] == "toggle":
+            manager.toggle()
+        elif message[0] == "clear":
+            manager.clear()
+            conn.send("cleared")
+        elif message[0] == "stop":
+            break
+
+
+class DisplayRenderWorker:
+    #Drop-in replacement of DisplayPowerManager, which runs rendering and
+    #SPI transfers in DisplayRenderWorkerMain() process, so they do not
+    #compete for GIL with measurement loop, mqtt network loop and button
+    #handling. Only frame arguments (few short strings) are sent over the
+    #pipe, rendered frames never leave the worker.
+
+    def __init__(self, sleep_panel=True, frame_cache_size=64):
+        self.sleep_panel = sleep_panel
+        self.frame_cache_size = frame_cache_size
+        self.lock = Lock()
+        self.display_on = False
+        self.frame_args = None
+        self.conn = None
+        self.process = None
+        self.start_worker()
+
+    def start_worker(self):
+        self.conn, worker_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=DisplayRenderWorkerMain, name="RenderWorker", args=(worker_conn, self.sleep_panel, self.frame_cache_size), daemon=True)
+        self.process.start()
+        worker_conn.close()
+
+    def send(self, message):
+        #restarts crashed worker and brings it to the current state
+        try:
+            self.conn.send(message)
+        except (OSError, EOFError):
+            logging.error('Render worker: exited with code %s, restarting...', self.process.exitcode)
+            self.process.join()
+            self.start_worker()
+            if self.display_on == True:
+                if self.frame_args is not None:
+                    self.conn.send(("frame", self.frame_args))
+                self.conn.send(("toggle",))
+            if message[0] != "toggle":
+                self.conn.send(message)
+
+    def show_measurements(self, *frame_args):
+        with self.lock:
+            self.frame_args = frame_args
+            self.send(("frame", frame_args))
+
+    def toggle(self):
+        with self.lock:
+            self.display_on = not self.display_on
+            logging.info('Backlight is %s!', "On" if self.display_on else "Off")
+            self.send(("toggle",))
+
+    def clear(self):
+        #clears the screen, turns backlight off and stops the worker, used at program exit
+        with self.lock:
+            try:
+                self.send(("clear",))
+                if self.conn.poll(RENDER_WORKER_STOP_TIMEOUT):
+                    self.conn.recv()
+                self.conn.send(("stop",))
+            except (OSError, EOFError):
+                logging.error('Render worker: failed to clear the screen: %s', repr(sys.exc_info()[1]))
+            self.process.join(RENDER_WORKER_STOP_TIMEOUT)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.display_on = False
@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+###############################################################
+# digitalthermometer_golden_frames_test.py renders measurement #
+# screen for a matrix of edge-case values (negative, single   #
+# and three digit values, sensor errors) without display and  #
+# checks that:                                                #
+#     - every frame is pixel-exact equal to its golden image  #
+#       stored in test/golden                                 #
+#     - RGB565 framebuffer matches converted golden image     #
+#     - rendering of every frame fits into time budget        #
+# Golden images depend on Pillow/FreeType version, regenerate #
+# them with -g after intended layout change or upgrade, i.e.: #
+#     python3 digitalthermometer_golden_frames_test.py        #
+#     python3 digitalthermometer_golden_frames_test.py -g     #
+###############################################################
+
+import time
+import sys
+import os
+import getopt
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+from PIL import Image, ImageChops
+
+from thermometerdisplay import NO_READING_STR, FrameRenderer, ImageToRGB565
+
+golden_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "golden")
+
+#Display is used in landscape orientation, see DisplayPowerManager
+WIDTH = 240
+HEIGHT = 240
+#Max render time of single frame (drawing and RGB565 conversion), in ms
+RENDER_BUDGET_MS = 50
+#Number of renders of every frame, the fastest one is compared with budget
+RENDER_REPEATS = 5
+
+PRIMARY = "#FFFFFF"
+TICKER_MQTT_UP = "#1AA3FF"
+TICKER_MQTT_DOWN = "#FF0000"
+BACKGROUND = "#1AA3FF"
+
+#name: (secondary color, indoor temperature, pressure, humidity, outdoor temperature)
+FRAMES = [
+    ("typical", (TICKER_MQTT_UP, "21", "1013", "45", "12")),
+    ("ticker_off", (PRIMARY, "21", "1013", "45", "12")),
+    ("mqtt_down", (TICKER_MQTT_DOWN, "21", "1013", "45", "12")),
+    ("zero", (TICKER_MQTT_UP, "0", "1000", "0", "0")),
+    ("single_digit", (TICKER_MQTT_UP, "7", "998", "9", "3")),
+    ("negative", (TICKER_MQTT_UP, "-12", "1021", "35", "-25")),
+    ("negative_single_digit", (TICKER_MQTT_UP, "-3", "1021", "80", "-7")),
+    ("three_digit", (TICKER_MQTT_UP, "105", "1100", "100", "-40")),
+    ("bme280_error", (TICKER_MQTT_UP, NO_READING_STR, NO_READING_STR, NO_READING_STR, "12")),
+    ("ds18b2_error", (TICKER_MQTT_UP, "21", "1013", "45", NO_READING_STR)),
+    ("all_sensors_error", (TICKER_MQTT_DOWN, NO_READING_STR, NO_READING_STR, NO_READING_STR, NO_READING_STR)),
+]
+
+def cmd_usage():
+    print ('Usage: '+sys.argv[0]+' {[-g | --generate regenerate golden images] [-b | --budget render budget in ms]}')
+    exit (1)
+
+def FrameArgs(values):
+    secondary, intemperature, inpressure, inhumidity, outtemperature = values
+    return (PRIMARY, secondary, BACKGROUND, intemperature, inpressure, inhumidity, outtemperature)
+
+def RenderFrame(renderer, frame_args):
+    #returns rendered image, RGB565 frame and the fastest render time in ms
+    best = None
+    for repeat in range(RENDER_REPEATS):
+        started = time.perf_counter()
+        frame = renderer.render(frame_args)
+        elapsed = (time.perf_counter() - started) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return renderer.image.copy(), bytes(frame), best
+
+def CheckFrame(name, image, frame):
+    #returns list of problems, empty if frame matches its golden image
+    golden_file = os.path.join(golden_dir, name + ".png")
+    try:
+        golden = Image.open(golden_file).convert("RGB")
+    except OSError:
+        return ["golden image %s not available, generate it with -g" % golden_file]
+    if golden.size != image.size:
+        return ["size %s differs from golden %s" % (image.size, golden.size)]
+    problems = []
+    bbox = ImageChops.difference(image, golden).getbbox()
+    if bbox is not None:
+        problems.append("pixels differ from golden image in area %s" % (bbox,))
+        image.save(os.path.join(golden_dir, name + ".actual.png"))
+    if frame != ImageToRGB565(golden, 0):
+        problems.append("RGB565 framebuffer differs from converted golden image")
+    return problems
+
+generate = False
+budget = RENDER_BUDGET_MS
+try:
+    options, arguments = getopt.getopt(sys.argv[1:], 'gb:', ['generate', 'budget='])
+except getopt.GetoptError as err:
+    print(str(err))
+    cmd_usage()
+
+for opt, arg in options:
+    if opt in ('-g', '--generate'):
+        generate = True
+    elif opt in ('-b', '--budget'):
+        budget = float(arg)
+
+renderer = FrameRenderer(WIDTH, HEIGHT)
+#fonts and work buffers are initialized by the first render
+renderer.render(FrameArgs(FRAMES[0][1]))
+
+failures = 0
+for name, values in FRAMES:
+    image, frame, render_time = RenderFrame(renderer, FrameArgs(values))
+    if generate:
+        os.makedirs(golden_dir, exist_ok=True)
+        image.save(os.path.join(golden_dir, name + ".png"))
+        print("%-24s golden image stored (%.1f ms)" % (name, render_time))
+        continue
+    problems = CheckFrame(name, image, frame)
+    if render_time > budget:
+        problems.append("render time %.1f ms exceeds budget %.1f ms" % (render_time, budget))
+    if problems:
+        failures = failures + 1
+        print("%-24s FAILED (%.1f ms): %s" % (name, render_time, "; ".join(problems)))
+    else:
+        print("%-24s ok (%.1f ms)" % (name, render_time))
+
+if generate:
+    exit(0)
+if failures:
+    print("FAILED: %i out of %i frames" % (failures, len(FRAMES)))
+    exit(1)
+print("PASSED")
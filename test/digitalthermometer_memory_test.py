@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+###############################################################
+# digitalthermometer_memory_test.py runs main measurement     #
+# loop of digitalthermometer against simulated hardware       #
+# (sensors, display, GPIO and MQTT client are replaced with   #
+# fakes) and checks that the loop does not leak memory:       #
+#     - net allocations traced by tracemalloc stay near zero  #
+#       per iteration after warm-up                           #
+#     - process RSS stays flat                                #
+# No Pi hardware is needed, only PIL and DejaVuSans font, i.e.:#
+#     python3 digitalthermometer_memory_test.py -n 100000     #
+###############################################################
+
+import time
+import sys
+import os
+import types
+import getopt
+import tracemalloc
+import tempfile
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src"))
+
+#Part of iterations run before the reference measurement is taken, frame
+#cache and all long-lived objects are filled during the warm-up
+WARMUP_RATIO = 0.1
+#Period of simulated sensor values in iterations, warm-up takes at least
+#one period, so all frames are cached before the reference measurement
+VALUE_PERIOD = 600
+#Max average net allocation per iteration after warm-up, in bytes
+MAX_NET_BYTES_PER_ITERATION = 1.0
+#Max growth of resident set size after warm-up, in bytes
+MAX_RSS_GROWTH = 1024 * 1024
+
+iterations = 100000
+checkpoints = {}
+
+def cmd_usage():
+    print ('Usage: '+sys.argv[0]+' {[-n | --iterations number of loop iterations]}')
+    exit (1)
+
+def GetRSS():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def WarmupIterations():
+    return max(int(iterations * WARMUP_RATIO), VALUE_PERIOD)
+
+def TakeCheckpoint(name):
+    current, peak = tracemalloc.get_traced_memory()
+    checkpoints[name] = (time.monotonic(), current, GetRSS())
+
+########################
+#Simulated hardware    #
+########################
+
+class FakePin:
+    def __init__(self, pin=None):
+        self.value = True
+    def switch_to_input(self):
+        pass
+    def switch_to_output(self):
+        self.value = False
+
+class FakeDisplay:
+    def __init__(self, spi, width, height, **kwargs):
+        self.width = width
+        self.height = height
+        self.frames = 0
+    def _block(self, x0, y0, x1, y1, data):
+        self.frames = self.frames + 1
+    def write(self, command=None, data=None):
+        pass
+    def image(self, image, rotation=0):
+        pass
+
+class FakeSMBus:
+    #single BME280 at 0x76, nothing at the other addresses
+    def __init__(self, bus_no):
+        self.bus_no = bus_no
+    def read_byte_data(self, address, register):
+        if address != 0x76:
+            raise OSError(121, "Remote I/O error")
+        return 0x60
+
+class FakeBME280Sample:
+    def __init__(self, iteration):
+        self.id = "fake-bme280"
+        #values repeat with period of VALUE_PERIOD iterations, so all
+        #frames are rendered and cached during the warm-up
+        self.temperature = 21.3 + (iteration // 50) % 3
+        self.pressure = 1013.2 + (iteration // 150) % 2
+        self.humidity = 45.6
+
+class FakeW1ThermSensor:
+    #measurement loop reads DS18B2 once per cycle, so it counts
+    #iterations and stops the loop with ctrl+C after the last one
+    id = "fake-ds18b2"
+    iteration = 0
+
+    def get_temperature(self):
+        FakeW1ThermSensor.iteration = FakeW1ThermSensor.iteration + 1
+        iteration = FakeW1ThermSensor.iteration
+        if iteration == WarmupIterations():
+            TakeCheckpoint("warmup")
+        if iteration > iterations:
+            TakeCheckpoint("end")
+            raise KeyboardInterrupt
+        return -4.6 + (iteration // 300) % 2
+
+class FakeMqttClient:
+    def __init__(self, *args, **kwargs):
+        self.published = 0
+    def reconnect_delay_set(self, min_delay, max_delay):
+        pass
+    def max_queued_messages_set(self, queue_size):
+        pass
+    def connect_async(self, host, port, keepalive):
+        self.on_connect(self, None, {}, 0)
+    def loop_start(self):
+        pass
+    def loop_stop(self):
+        pass
+    def disconnect(self):
+        pass
+    def publish(self, topic, payload, qos):
+        self.published = self.published + 1
+        return types.SimpleNamespace(mid=self.published, rc=0)
+
+def InstallFakeModules():
+    board = types.ModuleType("board")
+    for name in ("D12", "D16", "D20", "D21", "D22", "D23", "D24", "D25", "CE0"):
+        setattr(board, name, name)
+    board.SPI = lambda: None
+    digitalio = types.ModuleType("digitalio")
+    digitalio.DigitalInOut = FakePin
+    st7789 = types.ModuleType("adafruit_rgb_display.st7789")
+    st7789.ST7789 = FakeDisplay
+    adafruit_rgb_display = types.ModuleType("adafruit_rgb_display")
+    adafruit_rgb_display.st7789 = st7789
+    smbus2 = types.ModuleType("smbus2")
+    smbus2.SMBus = FakeSMBus
+    bme280 = types.ModuleType("bme280")
+    bme280.params = dict
+    bme280.load_calibration_params = lambda bus, address: bme280.params(dig_T1=1)
+    bme280.sample = lambda bus, address, params: FakeBME280Sample(FakeW1ThermSensor.iteration)
+    w1thermsensor = types.ModuleType("w1thermsensor")
+    w1thermsensor.W1ThermSensor = FakeW1ThermSensor
+    paho = types.ModuleType("paho")
+    paho_mqtt = types.ModuleType("paho.mqtt")
+    paho_mqtt_client = types.ModuleType("paho.mqtt.client")
+    paho_mqtt_client.Client = FakeMqttClient
+    paho_mqtt_client.MQTT_ERR_SUCCESS = 0
+    paho_mqtt_client.MQTT_ERR_NO_CONN = 4
+    paho_mqtt_client.MQTT_ERR_QUEUE_SIZE = 15
+    paho.mqtt = paho_mqtt
+    paho_mqtt.client = paho_mqtt_client
+    sys.modules.update({
+        "board": board,
+        "digitalio": digitalio,
+        "adafruit_rgb_display": adafruit_rgb_display,
+        "adafruit_rgb_display.st7789": st7789,
+        "smbus2": smbus2,
+        "bme280": bme280,
+        "w1thermsensor": w1thermsensor,
+        "paho": paho,
+        "paho.mqtt": paho_mqtt,
+        "paho.mqtt.client": paho_mqtt_client,
+    })
+
+try:
+    options, arguments = getopt.getopt(sys.argv[1:], 'n:', ['iterations='])
+except getopt.GetoptError as err:
+    print(str(err))
+    cmd_usage()
+
+for opt, arg in options:
+    if opt in ('-n', '--iterations'):
+        iterations = int(arg)
+
+if iterations <= WarmupIterations():
+    print("FAILED: at least %i iterations are needed, %i of them are warm-up" % (WarmupIterations() + 1, WarmupIterations()))
+    exit(1)
+
+InstallFakeModules()
+import digitialthermometer
+
+#run the loop as fast as possible, without http server, config file and
+#calibration file next to the script
+#(interval has to be positive to pass config validation)
+digitialthermometer.measurement_interval = 0.000001
+digitialthermometer.live_readings_port = 0
+digitialthermometer.config_file = os.path.join(tempfile.mkdtemp(), "digitialthermometer.json")
+digitialthermometer.bme280_calibration_file_pattern = os.path.join(tempfile.mkdtemp(), "bme280_calibration_{bus}_{address}.json")
+sys.argv = [sys.argv[0]]
+
+tracemalloc.start()
+try:
+    digitialthermometer.main()
+except SystemExit:
+    pass
+tracemalloc.stop()
+logging.shutdown()
+
+if "warmup" not in checkpoints or "end" not in checkpoints:
+    print("FAILED: measurement loop stopped before %i iterations" % iterations)
+    exit(1)
+
+warmup_time, warmup_traced, warmup_rss = checkpoints["warmup"]
+end_time, end_traced, end_rss = checkpoints["end"]
+measured = iterations - WarmupIterations()
+net_per_iteration = (end_traced - warmup_traced) / measured
+rss_growth = end_rss - warmup_rss
+
+print("Iterations after warm-up: %i (%.1f us per iteration)" % (measured, (end_time - warmup_time) / measured * 1000000))
+print("Traced memory: %.1f KiB -> %.1f KiB, net %.3f bytes per iteration (limit %.3f)" % (warmup_traced / 1024, end_traced / 1024, net_per_iteration, MAX_NET_BYTES_PER_ITERATION))
+print("RSS: %.1f KiB -> %.1f KiB, growth %.1f KiB (limit %.1f KiB)" % (warmup_rss / 1024, end_rss / 1024, rss_growth / 1024, MAX_RSS_GROWTH / 1024))
+
+failed = False
+if net_per_iteration > MAX_NET_BYTES_PER_ITERATION:
+    print("FAILED: net allocations per iteration exceed the limit")
+    failed = True
+if rss_growth > MAX_RSS_GROWTH:
+    print("FAILED: RSS grows")
+    failed = True
+if failed:
+    exit(1)
+print("PASSED")
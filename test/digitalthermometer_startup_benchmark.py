@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+
+###############################################################
+# digitalthermometer_startup_benchmark.py measures how long   #
+# it takes from process start until the first measurement     #
+# frame is shown on the display. Stop digitalthermometer      #
+# service before running the benchmark, i.e.:                 #
+#     sudo systemctl stop digitalthermometer                  #
+#     python3 digitalthermometer_startup_benchmark.py -n 5    #
+###############################################################
+
+import time
+import subprocess
+import signal
+import getopt
+import sys
+import os
+
+#Log line written by digitalthermometer when first frame is on the screen
+FIRST_FRAME_MARKER = "First frame on the screen"
+#Max time to wait for the first frame, in sec
+FIRST_FRAME_TIMEOUT = 60
+
+script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "src", "digitialthermometer.py")
+
+def cmd_usage():
+    print ('Usage: '+sys.argv[0]+' {[-n | --runs number of runs]}')
+    exit (1)
+
+def MeasureStartup():
+    started = time.monotonic()
+    process = subprocess.Popen([sys.executable, "-u", script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    first_frame = None
+    try:
+        for line in process.stdout:
+            if FIRST_FRAME_MARKER in line:
+                first_frame = time.monotonic() - started
+                break
+            if time.monotonic() - started > FIRST_FRAME_TIMEOUT:
+                break
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait()
+    return first_frame
+
+runs = 5
+try:
+    options, arguments = getopt.getopt(sys.argv[1:], 'n:', ['runs='])
+except getopt.GetoptError as err:
+    print(str(err))
+    cmd_usage()
+
+for opt, arg in options:
+    if opt in ('-n', '--runs'):
+        runs = int(arg)
+
+results = []
+for run in range(runs):
+    result = MeasureStartup()
+    if result is None:
+        print("Run %i: first frame not shown within %i sec!" % (run + 1, FIRST_FRAME_TIMEOUT))
+    else:
+        print("Run %i: first frame after %.3f sec" % (run + 1, result))
+        results.append(result)
+    #give display and sensors time to settle after SIGTERM
+    time.sleep(2)
+
+if results:
+    print("Time to first frame: min %.3f sec, avg %.3f sec, max %.3f sec" % (min(results), sum(results) / len(results), max(results)))